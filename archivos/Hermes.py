@@ -12,11 +12,34 @@ import tkinter.font as tkfont
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
 import threading
+import asyncio
+import socket
+import queue
+import logging
+import logging.handlers
+from collections import deque
 from datetime import datetime, timedelta
 import sys
 import csv
 import io
+import re
+import codecs
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+import pyexpat
 import urllib.parse
+import functools
+import itertools
+import heapq
+import hashlib
+import json
+import sqlite3
+import concurrent.futures
+import mmap
+import struct
+import bisect
+from array import array
 
 
 def _clamp(value):
@@ -326,6 +349,8 @@ class ShadowButton:
 try:
     import openpyxl
     from openpyxl import load_workbook
+    from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+    from openpyxl.utils.datetime import from_excel, from_ISO8601, WINDOWS_EPOCH, MAC_EPOCH
 except ImportError:
     print("\n" + "="*50)
     print("ERROR: Falta instalar dependencias")
@@ -346,6 +371,2480 @@ except ImportError:
     input()
     sys.exit(1)
 
+
+# ---------------------------------------------------------------------------
+# Lectura de archivos en streaming
+# ---------------------------------------------------------------------------
+
+CSV_DELIMITERS = ';,\t|'
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def detect_file_encoding(filepath, sample_size=ENCODING_SAMPLE_SIZE):
+    """Detectar la codificación de un archivo a partir de una muestra de bytes.
+
+    Orden: BOM (UTF-8 / UTF-16), validez UTF-8 y luego cp1252, con latin-1
+    como último recurso (latin-1 acepta cualquier byte).
+    """
+    with open(filepath, 'rb') as file:
+        sample = file.read(sample_size)
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+
+    # La muestra puede cortar un carácter multibyte al final: no es un error
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def sniff_csv_delimiter(sample, delimiters=CSV_DELIMITERS):
+    """Detectar el delimitador de un CSV a partir de una muestra de texto"""
+    # Descartar la última línea, que puede estar cortada
+    if '\n' in sample:
+        sample = sample[:sample.rindex('\n')]
+    if not sample:
+        return ','
+
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=delimiters).delimiter
+    except csv.Error:
+        pass
+
+    # Respaldo: el delimitador más frecuente en la línea de encabezados
+    header = sample.splitlines()[0]
+    counts = {delim: header.count(delim) for delim in delimiters}
+    best = max(counts, key=counts.get)
+    return best if counts[best] else ','
+
+
+class TabularStreamReader:
+    """Base de los lectores en streaming: entrega filas como listas de str
+    alineadas con ``fieldnames`` y avisa el progreso por callback."""
+
+    def __init__(self, filepath, progress_callback=None, progress_every=5000):
+        self.filepath = filepath
+        self.progress_callback = progress_callback
+        self.progress_every = max(1, progress_every)
+        self.fieldnames = []
+        self.rows_read = 0
+        self.elapsed = 0.0
+
+    def _iter_rows(self):
+        raise NotImplementedError
+
+    def close(self):
+        """Liberar los recursos del archivo (no-op por defecto)"""
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __iter__(self):
+        width = len(self.fieldnames)
+        callback = self.progress_callback
+        every = self.progress_every
+        self.rows_read = 0
+        started = time.perf_counter()
+
+        try:
+            for row in self._iter_rows():
+                if len(row) < width:
+                    row.extend([''] * (width - len(row)))
+                elif len(row) > width:
+                    del row[width:]
+
+                self.rows_read += 1
+                if callback and self.rows_read % every == 0:
+                    self.elapsed = time.perf_counter() - started
+                    callback(self.rows_read)
+                yield row
+        finally:
+            self.elapsed = time.perf_counter() - started
+            self.close()
+
+        if callback:
+            callback(self.rows_read)
+
+    def iter_chunks(self, chunk_size=5000):
+        """Entregar las filas en bloques de hasta ``chunk_size``"""
+        chunk = []
+        for row in self:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+class CSVStreamReader(TabularStreamReader):
+    """Lector CSV en streaming: detecta codificación y delimitador una sola vez"""
+
+    def __init__(self, filepath, progress_callback=None, progress_every=5000):
+        super().__init__(filepath, progress_callback, progress_every)
+        self.encoding = detect_file_encoding(filepath)
+        self.delimiter = sniff_csv_delimiter(self._read_text_sample())
+
+        with self._open() as file:
+            header = next(csv.reader(file, delimiter=self.delimiter), [])
+        self.fieldnames = [name.strip() for name in header]
+
+    def _open(self):
+        # 'replace' en lugar de 'ignore': un byte inválido no debe borrar texto en silencio
+        return open(self.filepath, 'r', encoding=self.encoding, errors='replace', newline='')
+
+    def _read_text_sample(self):
+        with self._open() as file:
+            return file.read(ENCODING_SAMPLE_SIZE)
+
+    def _iter_rows(self):
+        with self._open() as file:
+            reader = csv.reader(file, delimiter=self.delimiter)
+            next(reader, None)  # Encabezados
+            for row in reader:
+                # Igual que csv.DictReader: las líneas vacías no son filas
+                if row:
+                    yield row
+
+
+def excel_value_to_str(value):
+    """Convertir el valor de una celda al texto que usa Hermes"""
+    if value is None or value == '':
+        return ''
+    return str(value)
+
+
+class ExcelStreamReader(TabularStreamReader):
+    """Lector Excel sobre hojas read_only de openpyxl: memoria constante
+    sin importar la cantidad de filas"""
+
+    def __init__(self, filepath, progress_callback=None, progress_every=5000):
+        super().__init__(filepath, progress_callback, progress_every)
+        self.workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            self.sheet = self.workbook.active
+            # Las dimensiones guardadas en el archivo pueden estar mal: leer todo
+            self.sheet.reset_dimensions()
+            header = next(self.sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        except Exception:
+            self.close()
+            raise
+        self.fieldnames = [str(value).strip() if value is not None else '' for value in header]
+
+    def _iter_rows(self):
+        for values in self.sheet.iter_rows(min_row=2, values_only=True):
+            yield [excel_value_to_str(value) for value in values]
+
+    def close(self):
+        if self.workbook is not None:
+            self.workbook.close()
+            self.workbook = None
+
+
+XLSX_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XLSX_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+XLSX_OFFICE_DOCUMENT = XLSX_REL_NS + '/officeDocument'
+XLSX_SHARED_STRINGS = XLSX_REL_NS + '/sharedStrings'
+XLSX_STYLES = XLSX_REL_NS + '/styles'
+XLSX_WORKSHEET = XLSX_REL_NS + '/worksheet'
+XLSX_READ_CHUNK = 256 * 1024
+
+_XLSX_T = '{%s}t' % XLSX_MAIN_NS
+_XLSX_R = '{%s}r' % XLSX_MAIN_NS
+_XLSX_SI = '{%s}si' % XLSX_MAIN_NS
+
+
+class XlsxUnsupported(Exception):
+    """El lector rápido no puede procesar este libro: usar openpyxl"""
+
+
+def _xlsx_text(node):
+    """Texto de un <si>/<is>: texto plano más las corridas enriquecidas (sin fonética)"""
+    snippets = []
+    for child in node:
+        if child.tag == _XLSX_T:
+            snippets.append(child.text or '')
+        elif child.tag == _XLSX_R:
+            text = child.find(_XLSX_T)
+            if text is not None:
+                snippets.append(text.text or '')
+    return ''.join(snippets)
+
+
+def _xlsx_cast_number(value):
+    """Igual que openpyxl: int salvo que el texto tenga punto o exponente"""
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+class FastXlsxReader(TabularStreamReader):
+    """Lector XLSX directo: abre el zip, carga sharedStrings una vez y recorre
+    el XML de la hoja activa en streaming, sin crear celdas de openpyxl.
+
+    Devuelve los mismos textos que openpyxl en modo data_only (números,
+    fechas según el formato de la celda, booleanos y errores). Si el libro
+    tiene algo que no sabe leer lanza XlsxUnsupported.
+    """
+
+    def __init__(self, filepath, progress_callback=None, progress_every=5000):
+        super().__init__(filepath, progress_callback, progress_every)
+        self.archive = zipfile.ZipFile(filepath)
+        try:
+            self._load_workbook_parts()
+            self.fieldnames = [value.strip() for value in next(self._iter_sheet_rows(), [])]
+        except Exception:
+            self.close()
+            raise
+
+    def _read_rels(self, part):
+        """Relaciones de una parte del paquete: {id: (tipo, ruta)}"""
+        folder, name = posixpath.split(part)
+        rels_path = posixpath.join(folder, '_rels', name + '.rels')
+        try:
+            root = ET.fromstring(self.archive.read(rels_path))
+        except KeyError:
+            return {}
+
+        rels = {}
+        for rel in root.iter('{%s}Relationship' % XLSX_PKG_REL_NS):
+            if rel.get('TargetMode') == 'External':
+                continue
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                path = target.lstrip('/')
+            else:
+                path = posixpath.normpath(posixpath.join(folder, target))
+            rels[rel.get('Id')] = (rel.get('Type'), path)
+        return rels
+
+    def _load_workbook_parts(self):
+        workbook_part = None
+        for rel_type, path in self._read_rels('').values():
+            if rel_type == XLSX_OFFICE_DOCUMENT:
+                workbook_part = path
+        if workbook_part is None:
+            raise XlsxUnsupported("Libro sin parte principal (¿OOXML estricto?)")
+
+        workbook = ET.fromstring(self.archive.read(workbook_part))
+        if workbook.tag != '{%s}workbook' % XLSX_MAIN_NS:
+            raise XlsxUnsupported(f"Espacio de nombres no soportado: {workbook.tag}")
+
+        properties = workbook.find('{%s}workbookPr' % XLSX_MAIN_NS)
+        date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+        self.epoch = MAC_EPOCH if date1904 else WINDOWS_EPOCH
+
+        sheets = workbook.findall('{%s}sheets/{%s}sheet' % (XLSX_MAIN_NS, XLSX_MAIN_NS))
+        if not sheets:
+            raise XlsxUnsupported("El libro no tiene hojas")
+        view = workbook.find('{%s}bookViews/{%s}workbookView' % (XLSX_MAIN_NS, XLSX_MAIN_NS))
+        active = int(view.get('activeTab', 0)) if view is not None else 0
+        if not 0 <= active < len(sheets):
+            active = 0
+
+        rels = self._read_rels(workbook_part)
+        rel_type, sheet_path = rels.get(sheets[active].get('{%s}id' % XLSX_REL_NS), (None, None))
+        if rel_type != XLSX_WORKSHEET:
+            raise XlsxUnsupported("La hoja activa no es una hoja de cálculo")
+        self.sheet_path = sheet_path
+
+        self.shared_strings = []
+        self.date_styles = frozenset()
+        self.timedelta_styles = frozenset()
+        for rel_type, path in rels.values():
+            if rel_type == XLSX_SHARED_STRINGS:
+                self.shared_strings = self._load_shared_strings(path)
+            elif rel_type == XLSX_STYLES:
+                self._load_date_styles(path)
+
+    def _load_shared_strings(self, path):
+        strings = []
+        with self.archive.open(path) as source:
+            for _, node in ET.iterparse(source):
+                if node.tag == _XLSX_SI:
+                    strings.append(_xlsx_text(node).replace('x005F_', ''))
+                    node.clear()
+        return strings
+
+    def _load_date_styles(self, path):
+        """Índices de estilo cuyo formato numérico es fecha/hora (como openpyxl)"""
+        styles = ET.fromstring(self.archive.read(path))
+        custom = {}
+        for fmt in styles.iter('{%s}numFmt' % XLSX_MAIN_NS):
+            custom[int(fmt.get('numFmtId'))] = fmt.get('formatCode')
+
+        cell_xfs = styles.find('{%s}cellXfs' % XLSX_MAIN_NS)
+        if cell_xfs is None:
+            return
+
+        date_styles = set()
+        timedelta_styles = set()
+        for idx, xf in enumerate(cell_xfs.findall('{%s}xf' % XLSX_MAIN_NS)):
+            fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom[fmt_id] if fmt_id in custom else builtin_format_code(fmt_id)
+            if is_date_format(fmt):
+                date_styles.add(idx)
+            if is_timedelta_format(fmt):
+                timedelta_styles.add(idx)
+        self.date_styles = frozenset(date_styles)
+        self.timedelta_styles = frozenset(timedelta_styles)
+
+    def _cell_value(self, data_type, style, value):
+        """Texto de una celda a partir de su tipo, estilo y contenido crudo"""
+        if data_type == 'inlineStr':
+            return value
+        if not value:
+            return ''
+
+        if data_type == 'n':
+            number = _xlsx_cast_number(value)
+            if style and int(style) in self.date_styles:
+                style = int(style)
+                try:
+                    number = from_excel(number, self.epoch,
+                                        timedelta=style in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    return '#VALUE!'
+            return str(number)
+        if data_type == 's':
+            return self.shared_strings[int(value)]
+        if data_type == 'b':
+            return str(bool(int(value)))
+        if data_type == 'd':
+            return str(from_ISO8601(value))
+        # 'str' (resultado de fórmula) y 'e' (error) se leen tal cual
+        return value
+
+    def _sheet_prefix(self):
+        """Prefijo XML de la hoja ('' o p. ej. 'x:'), verificando su espacio de nombres"""
+        with self.archive.open(self.sheet_path) as source:
+            head = source.read(4096).decode('utf-8', errors='replace')
+        match = re.search(r'<(?:(\w+):)?worksheet\b([^>]*)>', head)
+        if not match:
+            raise XlsxUnsupported("No se encontró la raíz de la hoja")
+        prefix = match.group(1)
+        declaration = f'xmlns:{prefix}' if prefix else 'xmlns'
+        namespace = re.search(declaration + r'\s*=\s*["\']([^"\']*)', match.group(2))
+        if not namespace or namespace.group(1) != XLSX_MAIN_NS:
+            raise XlsxUnsupported("Espacio de nombres de hoja no soportado")
+        return prefix + ':' if prefix else ''
+
+    def _iter_sheet_rows(self):
+        """Filas de la hoja activa desde la 1, rellenando filas y celdas faltantes.
+
+        Se usa expat (el motor de iterparse) con callbacks directos: no se
+        construye ningún árbol, así que la memoria no depende de la hoja.
+        """
+        prefix = self._sheet_prefix()
+        row_tag = prefix + 'row'
+        cell_tag = prefix + 'c'
+        value_tag = prefix + 'v'
+        text_tag = prefix + 't'
+        phonetic_tag = prefix + 'rPh'
+        digits = '0123456789'
+        cell_value = self._cell_value
+        shared_strings = self.shared_strings
+
+        column_cache = {}
+        ready = []
+        values = []
+        parts = []
+        row_number = 0
+        column = 0
+        cell_type = 'n'
+        cell_style = None
+        collect = False
+        phonetic = False
+
+        def start(name, attrs):
+            nonlocal row_number, column, cell_type, cell_style, collect, phonetic, values
+            if name == cell_tag:
+                ref = attrs.get('r')
+                if ref:
+                    letters = ref.rstrip(digits)
+                    column = column_cache.get(letters)
+                    if column is None:
+                        column = 0
+                        for char in letters:
+                            column = column * 26 + ord(char) - 64
+                        column_cache[letters] = column
+                else:
+                    column += 1
+                cell_type = attrs.get('t', 'n')
+                cell_style = attrs.get('s')
+                parts.clear()
+            elif name == value_tag:
+                collect = True
+            elif name == text_tag:
+                collect = not phonetic
+            elif name == row_tag:
+                values = []
+                column = 0
+                number = attrs.get('r')
+                row_number = int(number) if number else row_number + 1
+            elif name == phonetic_tag:
+                phonetic = True
+
+        def end(name):
+            nonlocal collect, phonetic
+            if name == cell_tag:
+                if column > len(values) + 1:
+                    values.extend([''] * (column - 1 - len(values)))
+                text = ''.join(parts)
+                # Camino rápido para el caso más común: texto compartido
+                if cell_type == 's' and text:
+                    values.append(shared_strings[int(text)])
+                else:
+                    values.append(cell_value(cell_type, cell_style, text))
+            elif name == row_tag:
+                ready.append((row_number, values))
+            elif name == phonetic_tag:
+                phonetic = False
+            else:
+                collect = False
+
+        def data(text):
+            if collect:
+                parts.append(text)
+
+        parser = pyexpat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = data
+
+        next_row = 1
+        with self.archive.open(self.sheet_path) as source:
+            while True:
+                chunk = source.read(XLSX_READ_CHUNK)
+                parser.Parse(chunk, not chunk)
+                for number, row in ready:
+                    while next_row < number:
+                        next_row += 1
+                        yield []
+                    next_row = number + 1
+                    yield row
+                ready.clear()
+                if not chunk:
+                    break
+
+    def _iter_rows(self):
+        rows = self._iter_sheet_rows()
+        next(rows, None)  # Encabezados
+        yield from rows
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+
+def open_excel_stream(filepath, progress_callback=None, progress_every=5000):
+    """Abrir un Excel con el lector rápido, o con openpyxl si no lo soporta"""
+    try:
+        return FastXlsxReader(filepath, progress_callback, progress_every)
+    except (XlsxUnsupported, zipfile.BadZipFile, KeyError, ValueError, ET.ParseError):
+        return ExcelStreamReader(filepath, progress_callback, progress_every)
+
+
+# ---------------------------------------------------------------------------
+# Dataset columnar en memoria
+# ---------------------------------------------------------------------------
+
+class DatasetRow:
+    """Vista liviana de una fila de ColumnarDataset (no copia valores)"""
+
+    __slots__ = ('_dataset', '_index')
+
+    def __init__(self, dataset, index):
+        self._dataset = dataset
+        self._index = index
+
+    def get(self, column, default=''):
+        return self._dataset.value(self._index, column, default)
+
+    def __getitem__(self, column):
+        if column not in self._dataset.stored_columns:
+            raise KeyError(column)
+        return self._dataset.value(self._index, column)
+
+    def __contains__(self, column):
+        return column in self._dataset.stored_columns
+
+
+class ColumnarDataset:
+    """Datos tabulares guardados por columna.
+
+    Los nombres de columna se guardan una sola vez y cada columna es un
+    arreglo compacto de códigos (array 'I') sobre una tabla de valores
+    únicos, así cada texto repetido existe una sola vez en memoria.
+    ``columns`` conserva todos los encabezados del archivo para la UI;
+    ``project`` se queda solo con las columnas que realmente se usan.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.row_count = 0
+        self._codes = {}
+        self._values = {}
+        self._lookups = {}
+        self._positions = []
+        # Buffer (mmap) del que salen los códigos cuando viene de la caché
+        self._buffer = None
+
+    @classmethod
+    def from_chunks(cls, fieldnames, chunks, columns=None):
+        """Construir el dataset a partir de bloques de filas alineadas con ``fieldnames``.
+
+        ``columns`` limita qué columnas se guardan (por defecto todas las que
+        tienen nombre; si hay nombres repetidos gana el último, como en un dict).
+        """
+        dataset = cls(fieldnames)
+        wanted = None if columns is None else set(columns)
+        positions = {}
+        for idx, name in enumerate(fieldnames):
+            if name and (wanted is None or name in wanted):
+                positions[name] = idx
+
+        for name, idx in positions.items():
+            dataset._codes[name] = array('I')
+            dataset._lookups[name] = {}
+        dataset._positions = list(positions.items())
+
+        for chunk in chunks:
+            dataset.append_rows(chunk)
+        dataset.freeze()
+        return dataset
+
+    @classmethod
+    def from_columns(cls, fieldnames, row_count, columns, buffer=None):
+        """Armar un dataset ya construido: ``columns`` es {nombre: (códigos, valores)}"""
+        dataset = cls(fieldnames)
+        dataset.row_count = row_count
+        for name, (codes, values) in columns.items():
+            dataset._codes[name] = codes
+            dataset._values[name] = values
+        dataset._buffer = buffer
+        return dataset
+
+    def append_rows(self, rows):
+        """Agregar un bloque de filas (solo antes de ``freeze``)"""
+        for name, idx in self._positions:
+            lookup = self._lookups[name]
+            setdefault = lookup.setdefault
+            # setdefault devuelve el código existente o registra uno nuevo
+            self._codes[name].extend([setdefault(row[idx], len(lookup)) for row in rows])
+        self.row_count += len(rows)
+
+    def freeze(self):
+        """Cerrar la construcción: las tablas de búsqueda pasan a listas de valores"""
+        for name, lookup in self._lookups.items():
+            self._values[name] = list(lookup)
+        self._lookups = {}
+        self._positions = []
+
+    @property
+    def stored_columns(self):
+        return self._codes.keys()
+
+    def value(self, index, column, default=''):
+        codes = self._codes.get(column)
+        if codes is None:
+            return default
+        return self._values[column][codes[index]]
+
+    def column(self, column):
+        """Todos los valores de una columna, en orden de fila"""
+        values = self._values[column]
+        return [values[code] for code in self._codes[column]]
+
+    def project(self, columns):
+        """Nuevo dataset solo con ``columns`` (comparte los arreglos, no copia)"""
+        projected = ColumnarDataset(self.columns)
+        projected.row_count = self.row_count
+        projected._buffer = self._buffer
+        for name in columns:
+            if name in self._codes and name not in projected._codes:
+                projected._codes[name] = self._codes[name]
+                projected._values[name] = self._values[name]
+        return projected
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.row_count
+        if not 0 <= index < self.row_count:
+            raise IndexError("fila fuera de rango")
+        return DatasetRow(self, index)
+
+    def __iter__(self):
+        for index in range(self.row_count):
+            yield DatasetRow(self, index)
+
+
+def hermes_data_dir(*parts):
+    """Carpeta de datos persistentes de Hermes (junto al programa)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class DatasetCache:
+    """Caché en disco de datasets ya leídos, por ruta, tamaño y fecha de modificación.
+
+    Cada entrada es un archivo binario: un encabezado JSON con las columnas y
+    sus valores únicos, seguido de los arreglos de códigos, que al cargar se
+    usan directamente desde un mmap sin copiarlos. El tamaño total se acota
+    desalojando las entradas usadas hace más tiempo (LRU).
+    """
+
+    MAGIC = b'HERMESC1'
+    EXTENSION = '.hdc'
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, filepath):
+        stat = os.stat(filepath)
+        identity = f"{os.path.normcase(os.path.abspath(filepath))}|{stat.st_size}|{stat.st_mtime_ns}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, filepath):
+        return os.path.join(self.directory, self.key(filepath) + self.EXTENSION)
+
+    def load(self, filepath):
+        """Dataset en caché para ``filepath`` o None si no está (o no sirve)"""
+        path = self._entry_path(filepath)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'rb') as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if buffer[:len(self.MAGIC)] != self.MAGIC:
+                raise ValueError("firma inválida")
+            start = len(self.MAGIC)
+            header_size = int.from_bytes(buffer[start:start + 4], 'little')
+            header = json.loads(buffer[start + 4:start + 4 + header_size].decode('utf-8'))
+            if header['byteorder'] != sys.byteorder or header['itemsize'] != array('I').itemsize:
+                return None
+
+            view = memoryview(buffer)
+            row_count = header['row_count']
+            size = row_count * header['itemsize']
+            columns = {}
+            for column in header['columns']:
+                offset = column['offset']
+                columns[column['name']] = (view[offset:offset + size].cast('I'), column['values'])
+        except (OSError, ValueError, KeyError):
+            self._remove(path)
+            return None
+
+        # Marcar como usada recientemente para el desalojo LRU
+        os.utime(path)
+        return ColumnarDataset.from_columns(header['fieldnames'], row_count, columns, buffer)
+
+    def store(self, filepath, dataset):
+        """Guardar ``dataset`` como entrada de ``filepath`` y aplicar el límite de tamaño"""
+        path = self._entry_path(filepath)
+        itemsize = array('I').itemsize
+        names = list(dataset.stored_columns)
+
+        header = {
+            'fieldnames': dataset.columns,
+            'row_count': len(dataset),
+            'byteorder': sys.byteorder,
+            'itemsize': itemsize,
+            'columns': [{'name': name, 'values': dataset._values[name], 'offset': 0} for name in names],
+        }
+        # Los offsets dependen del tamaño del encabezado: calcularlo dos veces
+        # alcanza porque reservamos ancho fijo para cada offset
+        for column in header['columns']:
+            column['offset'] = 10 ** 15
+        header_size = len(json.dumps(header, ensure_ascii=False).encode('utf-8'))
+        data_start = len(self.MAGIC) + 4 + header_size
+        data_start += -data_start % itemsize
+        for idx, column in enumerate(header['columns']):
+            column['offset'] = data_start + idx * len(dataset) * itemsize
+        encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        encoded += b' ' * (header_size - len(encoded))
+
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(self.MAGIC)
+                file.write(len(encoded).to_bytes(4, 'little'))
+                file.write(encoded)
+                file.write(b'\0' * (data_start - file.tell()))
+                for name in names:
+                    file.write(dataset._codes[name].tobytes())
+            os.replace(temp_path, path)
+        finally:
+            self._remove(temp_path)
+        self.evict()
+
+    def evict(self):
+        """Borrar las entradas menos usadas hasta quedar bajo ``max_bytes``"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.EXTENSION):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        # En Windows una entrada abierta con mmap no se puede borrar: se reintenta luego
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+# ---------------------------------------------------------------------------
+# Plantillas de mensaje
+# ---------------------------------------------------------------------------
+
+MONEY_COLUMN_MARKERS = ('$ Hist.', '$ Asig.')
+
+
+def format_plain_value(value):
+    """Texto de un valor tal cual (None se muestra vacío)"""
+    return '' if value is None else str(value)
+
+
+def format_money_value(value):
+    """Formatear un valor como peso ($1,234.50); si no es numérico queda igual"""
+    value = format_plain_value(value)
+    try:
+        return f"${float(value.replace(',', '').replace('$', '').strip()):,.2f}"
+    except ValueError:
+        return value
+
+
+def column_formatter(column):
+    """Formateador de una columna: moneda si contiene "$ Hist." o "$ Asig." """
+    if any(marker in column for marker in MONEY_COLUMN_MARKERS):
+        return format_money_value
+    return format_plain_value
+
+
+class MessageTemplate:
+    """Plantilla de mensaje compilada.
+
+    Se parsea una sola vez en segmentos literales y campos {Columna}, con el
+    formateador de cada columna resuelto de antemano; cada fila se arma con
+    un único join. Solo se reemplazan los campos de ``columns``: el resto de
+    llaves queda como texto literal.
+    """
+
+    PLACEHOLDER_RE = re.compile(r'\{([^{}]*)\}')
+
+    def __init__(self, template, columns):
+        available = set(columns)
+        self.template = template
+        self.fields = []
+        self._parts = []
+        self._slots = []
+
+        last = 0
+        for match in self.PLACEHOLDER_RE.finditer(template):
+            column = match.group(1)
+            if column not in available:
+                continue
+            self._parts.append(template[last:match.start()])
+            self._slots.append((len(self._parts), column, column_formatter(column)))
+            self._parts.append('')
+            if column not in self.fields:
+                self.fields.append(column)
+            last = match.end()
+        self._parts.append(template[last:])
+
+    def render(self, row):
+        """Armar el mensaje para una fila (cualquier objeto con ``get``)"""
+        parts = self._parts.copy()
+        for position, column, formatter in self._slots:
+            parts[position] = formatter(row.get(column, ''))
+        return ''.join(parts)
+
+
+# ---------------------------------------------------------------------------
+# Enlaces de WhatsApp
+# ---------------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=4096)
+def quote_message(message):
+    """Codificar un mensaje para URL preservando emojis (memoizado: los
+    cuerpos repetidos se codifican una sola vez)"""
+    return urllib.parse.quote(message, safe='')
+
+
+def build_whatsapp_url(phone, message):
+    """URL wa.me para un teléfono sin prefijo +549"""
+    return f"https://wa.me/549{phone}?text={quote_message(message)}"
+
+
+def split_phones(value):
+    """Separar una celda de teléfonos del tipo "11223344-55667788" """
+    if not value:
+        return []
+    return [num.strip() for num in str(value).split('-') if num.strip()]
+
+
+MIN_PHONE_DIGITS = 10
+MAX_PHONE_DIGITS = 15
+_NON_DIGITS = re.compile(r'\D+')
+PHONE_FIELD_SEPARATORS = re.compile(r'[;,\t|]')
+
+
+def normalize_phone(value):
+    """Teléfono reducido a su número local como entero (None si no parece uno).
+
+    Acepta los formatos habituales: con o sin +54/549, con 00 internacional,
+    0 de larga distancia, espacios o paréntesis.
+    """
+    digits = str(value).strip()
+    if not digits.isdigit():
+        if digits.endswith('.0'):
+            # Celda numérica de Excel leída como float
+            digits = digits[:-2]
+        digits = _NON_DIGITS.sub('', digits)
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    if digits[0] == '0':
+        digits = digits[2:] if digits[1] == '0' else digits[1:]
+    if len(digits) >= 12 and digits[:2] == '54':
+        digits = digits[3:] if digits[2] == '9' else digits[2:]
+    if not MIN_PHONE_DIGITS <= len(digits) <= MAX_PHONE_DIGITS:
+        return None
+    return int(digits)
+
+
+def phone_field_numbers(field):
+    """Números de un campo de texto o CSV (lista vacía si no trae ninguno).
+
+    El guion separa varios números solo si cada parte es un número completo,
+    como en "1122334455-1199998888"; si no, es parte del formato
+    ("11-3344-5566", "011 4455-6677").
+    """
+    if '-' in field:
+        parts = [part for part in field.split('-') if part.strip()]
+        numbers = [normalize_phone(part) for part in parts]
+        if len(numbers) > 1 and None not in numbers:
+            return numbers
+    number = normalize_phone(field)
+    return [] if number is None else [number]
+
+
+class SuppressionList:
+    """Lista de bajas: números que pidieron no ser contactados.
+
+    La base es un arreglo ordenado de enteros (8 bytes por número) con un
+    directorio de cubetas sobre los bits altos: cada consulta busca solo en
+    el tramo de su cubeta. Las altas nuevas van a un registro de texto y a un
+    set en memoria; cuando ese registro crece se fusiona con la base, que ya
+    está ordenada, sin reordenar ni releer los archivos de origen.
+    """
+
+    MAGIC = b'HERMESB1'
+    HEADER = struct.Struct('<8sQ')
+    BUCKET_BITS = 16
+    COMPACT_AT = 200000
+    IMPORT_BLOCK = 2 * 1024 * 1024
+
+    def __init__(self, directory, compact_at=COMPACT_AT):
+        self.index_path = os.path.join(directory, 'bajas.idx')
+        self.log_path = os.path.join(directory, 'bajas.log')
+        self.compact_at = compact_at
+        self._lock = threading.Lock()
+        self._index = self._build_index(array('Q'))
+        self._delta = set()
+        self.load()
+
+    def _build_index(self, base):
+        shift = max(0, base[-1].bit_length() - self.BUCKET_BITS) if base else 0
+        bounds = array('I', (bisect.bisect_left(base, bucket << shift)
+                             for bucket in range(1 << self.BUCKET_BITS)))
+        bounds.append(len(base))
+        return base, bounds, shift
+
+    def load(self):
+        base = array('Q')
+        try:
+            with open(self.index_path, 'rb') as handle:
+                magic, count = self.HEADER.unpack(handle.read(self.HEADER.size))
+                if magic != self.MAGIC:
+                    raise ValueError("firma inválida")
+                base.fromfile(handle, count)
+        except (OSError, EOFError, ValueError, struct.error):
+            base = array('Q')
+        self._index = self._build_index(base)
+
+        delta = set()
+        try:
+            with open(self.log_path, encoding='ascii') as handle:
+                for line in handle:
+                    # Una línea cortada por un cierre brusco se descarta
+                    if line.endswith('\n') and line[:-1].isdigit():
+                        delta.add(int(line))
+        except OSError:
+            pass
+        # Tras una compactación interrumpida el registro repite números de la base
+        self._delta = {number for number in delta if not self._in_base(number)}
+        if len(self._delta) >= self.compact_at:
+            with self._lock:
+                self.compact()
+
+    def _in_base(self, number):
+        base, bounds, shift = self._index
+        bucket = number >> shift
+        if bucket >= len(bounds) - 1:
+            return False
+        hi = bounds[bucket + 1]
+        position = bisect.bisect_left(base, number, bounds[bucket], hi)
+        return position < hi and base[position] == number
+
+    def __contains__(self, number):
+        return number in self._delta or self._in_base(number)
+
+    def __len__(self):
+        return len(self._index[0]) + len(self._delta)
+
+    def add_many(self, numbers):
+        """Agregar números ya normalizados; devuelve cuántos eran nuevos"""
+        with self._lock:
+            fresh = set(numbers)
+            fresh -= self._delta
+            fresh = [number for number in fresh if not self._in_base(number)]
+            if not fresh:
+                return 0
+            with open(self.log_path, 'a', encoding='ascii') as handle:
+                handle.write(''.join(f"{number}\n" for number in fresh))
+            self._delta.update(fresh)
+            # Umbral proporcional a la base: cada fusión copia la base entera,
+            # así el costo por número agregado se mantiene constante
+            if len(self._delta) >= max(self.compact_at, len(self._index[0]) // 4):
+                self.compact()
+            return len(fresh)
+
+    def compact(self):
+        """Fusionar el registro de altas con la base ordenada (con el lock tomado)"""
+        # La base ya es una corrida ordenada: timsort solo intercala las altas
+        # ordenadas a continuación, en tiempo lineal
+        merged = self._index[0] + array('Q', sorted(self._delta))
+        merged = array('Q', sorted(merged))
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as handle:
+            handle.write(self.HEADER.pack(self.MAGIC, len(merged)))
+            merged.tofile(handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, self.index_path)
+
+        self._index = self._build_index(merged)
+        self._delta = set()
+        open(self.log_path, 'w').close()
+
+    def import_file(self, path, progress=None):
+        """Importar un .txt o .csv de teléfonos; devuelve (leídos, nuevos, sin leer).
+
+        Se toma cada línea o campo CSV como una entrada (ver
+        ``phone_field_numbers``). "Sin leer" cuenta las líneas con texto en
+        las que no se reconoció ningún número. Las tandas ya agregadas quedan
+        aunque se cancele.
+        """
+        read = added = unparsed = 0
+        with open(path, encoding=detect_file_encoding(path), errors='replace', newline='') as handle:
+            while True:
+                lines = handle.readlines(self.IMPORT_BLOCK)
+                if not lines:
+                    break
+                batch = []
+                for line in lines:
+                    found = False
+                    for field in PHONE_FIELD_SEPARATORS.split(line):
+                        numbers = phone_field_numbers(field)
+                        if numbers:
+                            batch.extend(numbers)
+                            found = True
+                    if not found and line.strip():
+                        unparsed += 1
+                read += len(batch)
+                added += self.add_many(batch)
+                if progress:
+                    progress(read)
+        # Dejar todo en la base binaria: el próximo arranque no relee texto
+        with self._lock:
+            if self._delta:
+                self.compact()
+        return read, added, unparsed
+
+
+class LinkFilter:
+    """Decide qué teléfonos reciben mensaje y cuenta los que se omiten.
+
+    Cada teléfono se normaliza una sola vez y se compara contra la lista de
+    bajas y, si hay tope de frecuencia (``recent`` no es None), contra los
+    números contactados dentro del tope. Los números que pasan se suman a
+    ``recent``: un número repetido en la misma carga recibe un solo mensaje.
+    """
+
+    def __init__(self, suppression, recent=None):
+        self.suppression = suppression
+        self.recent = recent
+        self.suppressed = 0
+        self.capped = 0
+
+    def allows(self, phone):
+        number = normalize_phone(phone)
+        if number is None:
+            return True
+        if number in self.suppression:
+            self.suppressed += 1
+            return False
+        if self.recent is not None:
+            if number in self.recent:
+                self.capped += 1
+                return False
+            self.recent.add(number)
+        return True
+
+
+class LinkSource:
+    """Secuencia perezosa de URLs de WhatsApp.
+
+    El total se conoce de antemano, pero cada URL se arma y codifica recién
+    cuando se pide, por índice o iterando. Las subclases implementan
+    ``resolve(index)``, que devuelve el par (teléfono, mensaje).
+    """
+
+    def __init__(self, total):
+        self.total = total
+
+    def resolve(self, index):
+        raise NotImplementedError
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError("enlace fuera de rango")
+        phone, message = self.resolve(index)
+        return build_whatsapp_url(phone, message)
+
+    def __iter__(self):
+        for index in range(self.total):
+            yield self[index]
+
+
+class RowLinkSource(LinkSource):
+    """Enlaces de un dataset: un mensaje por fila, una URL por teléfono"""
+
+    def __init__(self, dataset, template, phone_columns, link_filter=None):
+        self.dataset = dataset
+        self.template = template
+        self.phone_columns = list(phone_columns)
+        # Por enlace solo se guarda la fila y qué teléfono de la fila usar
+        self._rows = array('I')
+        self._slots = array('H')
+        for index, row in enumerate(dataset):
+            phones = self._row_phones(row)
+            if link_filter is None:
+                slots = range(len(phones))
+            else:
+                slots = [slot for slot, phone in enumerate(phones) if link_filter.allows(phone)]
+            self._rows.extend([index] * len(slots))
+            self._slots.extend(slots)
+        self._last = (-1, '')
+        super().__init__(len(self._rows))
+
+    def _row_phones(self, row):
+        phones = []
+        for column in self.phone_columns:
+            phones.extend(split_phones(row.get(column, '')))
+        return phones
+
+    def resolve(self, index):
+        row_index = self._rows[index]
+        row = self.dataset[row_index]
+        phone = self._row_phones(row)[self._slots[index]]
+
+        # Los teléfonos de una misma fila comparten mensaje: no re-renderizar
+        last_index, message = self._last
+        if last_index != row_index:
+            message = self.template.render(row)
+            self._last = (row_index, message)
+        return phone, message
+
+
+class FidelizadoSchedule:
+    """Orden de números Fidelizado calculado en tiempo y memoria constantes.
+
+    Equivale a repetir cada número ``len(numbers)`` veces seguidas y repetir
+    ese bloque hasta cubrir ``total`` mensajes, sin construir la lista: el
+    número del mensaje k es numbers[(k % n²) // n]. Permite acceso directo
+    (``schedule[k]``) para reanudar o previsualizar desde cualquier punto.
+    """
+
+    def __init__(self, numbers, total):
+        self.numbers = list(numbers)
+        self.total = total if self.numbers else 0
+        self._count = len(self.numbers)
+        self._block = self._count * self._count
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError("mensaje fuera de rango")
+        return self.numbers[(index % self._block) // self._count]
+
+    def __iter__(self):
+        for index in range(self.total):
+            yield self[index]
+
+
+class ManualLinkSource(LinkSource):
+    """Enlaces Fidelizado: el número de cada mensaje sale de una secuencia"""
+
+    def __init__(self, sequence, messages):
+        self.sequence = sequence
+        self.messages = messages
+        super().__init__(min(len(sequence), len(messages)))
+
+    def resolve(self, index):
+        return self.sequence[index], self.messages[index]
+
+
+def export_links(links, output_path, progress_callback=None, cancel_event=None, chunk_size=5000):
+    """Exportar URLs a Excel (write_only, en streaming) o a CSV según la extensión.
+
+    Se escribe en un archivo temporal que reemplaza al destino solo al
+    terminar, así una cancelación o un error no dejan archivos a medias.
+    """
+    temp_path = output_path + '.tmp'
+    as_csv = output_path.lower().endswith('.csv')
+    written = 0
+
+    def chunks():
+        chunk = []
+        for url in links:
+            chunk.append((url,))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def advance(chunk):
+        nonlocal written
+        if cancel_event is not None and cancel_event.is_set():
+            raise OperationCancelled()
+        written += len(chunk)
+        if progress_callback:
+            progress_callback(written)
+
+    try:
+        if as_csv:
+            # utf-8-sig para que Excel lo abra con la codificación correcta
+            with open(temp_path, 'w', encoding='utf-8-sig', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(('URL',))
+                for chunk in chunks():
+                    writer.writerows(chunk)
+                    advance(chunk)
+        else:
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet("URLs WhatsApp")
+            sheet.append(('URL',))
+            for chunk in chunks():
+                for row in chunk:
+                    sheet.append(row)
+                advance(chunk)
+            workbook.save(temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return written
+
+
+# ---------------------------------------------------------------------------
+# Tareas en segundo plano
+# ---------------------------------------------------------------------------
+
+class OperationCancelled(Exception):
+    """El usuario canceló una tarea en segundo plano"""
+
+
+class BackgroundTask:
+    """Ejecuta ``work(report, cancel_event)`` en un hilo y entrega progreso,
+    mensajes de log (``log``) y resultado en el hilo de Tk mediante una cola
+    drenada con ``root.after``."""
+
+    POLL_MS = 100
+
+    def __init__(self, root, work, on_progress=None, on_done=None, on_error=None, on_log=None):
+        self.root = root
+        self.work = work
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_log = on_log
+        self.cancel_event = threading.Event()
+        self._queue = queue.Queue()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self.root.after(self.POLL_MS, self._poll)
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _report(self, value):
+        self._queue.put(('progress', value))
+
+    def log(self, msg, tag='info'):
+        """Mensaje para el log desde el hilo de trabajo"""
+        self._queue.put(('log', (msg, tag)))
+
+    def _run(self):
+        try:
+            result = self.work(self._report, self.cancel_event)
+        except Exception as exc:
+            self._queue.put(('error', exc))
+        else:
+            self._queue.put(('done', result))
+
+    def _poll(self):
+        # Solo interesa el último valor de progreso de cada tanda
+        latest = None
+        while True:
+            try:
+                kind, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                latest = value
+                continue
+            if kind == 'log':
+                if self.on_log:
+                    self.on_log(*value)
+                continue
+            if latest is not None and self.on_progress:
+                self.on_progress(latest)
+            callback = self.on_done if kind == 'done' else self.on_error
+            if callback:
+                callback(value)
+            return
+
+        if latest is not None and self.on_progress:
+            self.on_progress(latest)
+        self.root.after(self.POLL_MS, self._poll)
+
+
+class ProgressDialog:
+    """Ventana con barra de progreso y botón de cancelar opcional"""
+
+    def __init__(self, root, title, message, maximum=None, on_cancel=None, bg='#f8f9fa'):
+        self.window = tk.Toplevel(root)
+        self.window.title(title)
+        self.window.configure(bg=bg)
+        self.window.transient(root)
+        self.window.resizable(False, False)
+        self.window.geometry("420x170")
+
+        content = tk.Frame(self.window, bg='#ffffff')
+        content.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
+
+        self.label = tk.Label(content, text=message, font=('Inter', 11),
+                              bg='#ffffff', fg='#202124', anchor='w', justify='left')
+        self.label.pack(fill=tk.X, padx=16, pady=(16, 10))
+
+        self.maximum = maximum
+        mode = 'determinate' if maximum else 'indeterminate'
+        self.bar = ttk.Progressbar(content, mode=mode, maximum=maximum or 100)
+        self.bar.pack(fill=tk.X, padx=16)
+        if not maximum:
+            self.bar.start(15)
+
+        if on_cancel:
+            ttk.Button(content, text="Cancelar", command=on_cancel).pack(anchor='e', padx=16, pady=(12, 0))
+            self.window.protocol("WM_DELETE_WINDOW", on_cancel)
+        else:
+            self.window.protocol("WM_DELETE_WINDOW", lambda: None)
+
+    def update(self, value=None, text=None):
+        if value is not None and self.maximum:
+            self.bar['value'] = min(value, self.maximum)
+        if text is not None:
+            self.label.config(text=text)
+
+    def close(self):
+        if self.window.winfo_exists():
+            self.window.destroy()
+
+
+LOG_MAX_LINES = 5000
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+LOG_LEVELS = {'error': logging.ERROR, 'warning': logging.WARNING}
+
+
+class LogSink:
+    """Log de Hermes que nunca bloquea a quien escribe.
+
+    ``write`` solo encola la línea y sirve desde cualquier hilo. El hilo de
+    Tk vacía la cola por tandas cada ``POLL_MS`` y el widget conserva las
+    últimas ``max_lines`` líneas. En paralelo, un ``QueueListener`` escribe
+    un archivo rotativo desde su propio hilo.
+    """
+
+    POLL_MS = 100
+    BATCH_LIMIT = 2000
+
+    def __init__(self, root, path, max_lines=LOG_MAX_LINES):
+        self.root = root
+        self.max_lines = max_lines
+        self.widget = None
+        self._lines = 0
+        self._queue = queue.SimpleQueue()
+
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        file_queue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(file_queue, handler)
+        self._logger = logging.getLogger('hermes')
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(logging.handlers.QueueHandler(file_queue))
+        self._listener.start()
+
+    def attach(self, widget):
+        """Empezar a volcar la cola en el widget de texto"""
+        self.widget = widget
+        self.root.after(self.POLL_MS, self._drain)
+
+    def write(self, msg, tag='info'):
+        ts = datetime.now().strftime("[%H:%M:%S]")
+        self._queue.put((f"{ts} {msg}\n", tag))
+        self._logger.log(LOG_LEVELS.get(tag, logging.INFO), msg)
+
+    def _drain(self):
+        chunks = []
+        while len(chunks) < 2 * self.BATCH_LIMIT:
+            try:
+                text, tag = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            chunks.extend((text, tag))
+            self._lines += text.count('\n')
+
+        if chunks:
+            # Un solo insert por tanda y un solo recorte del principio
+            self.widget.insert(tk.END, *chunks)
+            if self._lines > self.max_lines:
+                excess = self._lines - self.max_lines
+                self.widget.delete('1.0', f'{excess + 1}.0')
+                self._lines = self.max_lines
+            self.widget.see(tk.END)
+
+        # Si quedó cola por vaciar, seguir enseguida
+        delay = 1 if len(chunks) >= 2 * self.BATCH_LIMIT else self.POLL_MS
+        self.root.after(delay, self._drain)
+
+    def close(self):
+        """Terminar de escribir el archivo pendiente"""
+        self._listener.stop()
+
+
+# ---------------------------------------------------------------------------
+# Envío
+# ---------------------------------------------------------------------------
+
+class AdbError(Exception):
+    """Error de comunicación con ADB"""
+
+
+class AdbSessionClosed(AdbError):
+    """La sesión de shell del dispositivo se cerró"""
+
+
+ADB_SERVER_HOST = '127.0.0.1'
+ADB_SERVER_PORT = 5037
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise AdbError("Conexión cerrada por el servidor ADB")
+        data += chunk
+    return bytes(data)
+
+
+def parse_device_listing(listing):
+    """Pares (serial, estado) de un listado de ``adb devices``/``host:devices``"""
+    devices = []
+    for line in listing.splitlines():
+        serial, sep, state = line.partition('\t')
+        if sep and serial:
+            devices.append((serial.strip(), state.strip()))
+    return devices
+
+
+class AdbClient:
+    """Cliente del protocolo host de ADB.
+
+    Habla directamente con el servidor ADB local (TCP 5037) en lugar de
+    lanzar adb.exe: cada petición es un mensaje con longitud en 4 dígitos
+    hexadecimales y el servidor responde OKAY o FAIL.
+    """
+
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def _connect(self):
+        return socket.create_connection((self.host, self.port), timeout=self.timeout)
+
+    @staticmethod
+    def _read_message(sock):
+        length = int(_recv_exactly(sock, 4), 16)
+        return _recv_exactly(sock, length).decode('utf-8', errors='replace')
+
+    def _request(self, sock, service):
+        payload = service.encode('utf-8')
+        sock.sendall(b'%04x' % len(payload) + payload)
+        status = _recv_exactly(sock, 4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise AdbError(self._read_message(sock))
+        raise AdbError(f"Respuesta inesperada del servidor ADB: {status!r}")
+
+    def devices(self):
+        """Lista de (serial, estado) de ``host:devices``"""
+        with self._connect() as sock:
+            self._request(sock, 'host:devices')
+            listing = self._read_message(sock)
+        return parse_device_listing(listing)
+
+    async def track_devices(self):
+        """Generador de listas (serial, estado) cada vez que cambian (``host:track-devices``)"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            await self._request_async(reader, writer, 'host:track-devices')
+            while True:
+                try:
+                    length = int(await reader.readexactly(4), 16)
+                    listing = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    raise AdbError("Conexión cerrada por el servidor ADB")
+                yield parse_device_listing(listing.decode('utf-8', errors='replace'))
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _request_async(reader, writer, service):
+        payload = service.encode('utf-8')
+        writer.write(b'%04x' % len(payload) + payload)
+        await writer.drain()
+        try:
+            status = await reader.readexactly(4)
+            if status == b'OKAY':
+                return
+            if status == b'FAIL':
+                length = int(await reader.readexactly(4), 16)
+                raise AdbError((await reader.readexactly(length)).decode('utf-8', errors='replace'))
+        except asyncio.IncompleteReadError:
+            raise AdbError("Conexión cerrada por el servidor ADB")
+        raise AdbError(f"Respuesta inesperada del servidor ADB: {status!r}")
+
+    async def open_service(self, serial, service):
+        """Abrir ``service`` en el dispositivo y devolver (reader, writer) ya conectados"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            await self._request_async(reader, writer, f'host:transport:{serial}')
+            await self._request_async(reader, writer, service)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+
+class AdbShellSession:
+    """Sesión ``adb shell`` persistente (asyncio) para un dispositivo.
+
+    Mantiene un único proceso ``adb -s <serial> shell`` abierto y le envía
+    los comandos por stdin. Cada comando termina con un centinela único que
+    trae el código de salida, así se sabe dónde termina su salida sin abrir
+    un proceso por comando. Si el pipe muere, la sesión se reabre sola.
+    """
+
+    def __init__(self, adb_path, serial):
+        self.adb_path = adb_path
+        self.serial = serial
+        self._process = None
+        self._reader = None
+        self._writer = None
+        self._lock = None
+        self._counter = itertools.count()
+
+    async def _open(self):
+        self._process = await asyncio.create_subprocess_exec(
+            self.adb_path, '-s', self.serial, 'shell',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        self._reader = self._process.stdout
+        self._writer = self._process.stdin
+
+    def is_alive(self):
+        if self._writer is None:
+            return False
+        return self._process is None or self._process.returncode is None
+
+    async def run(self, command, timeout=10):
+        """Ejecutar ``command`` en el dispositivo y devolver (código de salida, salida)"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            for attempt in (1, 2):
+                if not self.is_alive():
+                    await self.close()
+                    await self._open()
+                try:
+                    return await self._execute(command, timeout)
+                except (OSError, AdbSessionClosed):
+                    # Pipe roto o shell terminada: reconectar y reintentar una vez
+                    await self.close()
+                    if attempt == 2:
+                        raise AdbSessionClosed(f"Sesión ADB cerrada en {self.serial}")
+
+    async def _execute(self, command, timeout):
+        marker = f"__HERMES_{next(self._counter)}__"
+        # Sólo cuenta el centinela seguido del código: con PTY la línea del comando vuelve como eco
+        marker_re = re.compile(re.escape(marker) + r'(-?\d+)')
+        payload = f"{{ {command}\n}} </dev/null 2>&1; echo {marker}$?\n"
+        self._writer.write(payload.encode('utf-8'))
+        await self._writer.drain()
+
+        deadline = time.monotonic() + timeout
+        output = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # La salida quedó desfasada: descartar la sesión
+                await self.close()
+                raise subprocess.TimeoutExpired(command, timeout)
+            try:
+                raw = await asyncio.wait_for(self._reader.readline(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if not raw:
+                raise AdbSessionClosed(f"Sesión ADB cerrada en {self.serial}")
+
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            match = marker_re.search(line)
+            if match:
+                before = line[:match.start()]
+                if before:
+                    output.append(before)
+                return int(match.group(1)), '\n'.join(output)
+            output.append(line)
+
+    async def close(self):
+        writer, self._writer = self._writer, None
+        process, self._process = self._process, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, RuntimeError):
+                pass
+        if process is not None and process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            try:
+                await asyncio.wait_for(process.wait(), 2)
+            except asyncio.TimeoutError:
+                pass
+
+
+class AdbSocketShellSession(AdbShellSession):
+    """Sesión de shell persistente sobre el protocolo host (sin adb.exe)"""
+
+    def __init__(self, client, serial):
+        super().__init__(None, serial)
+        self.client = client
+
+    async def _open(self):
+        try:
+            # shell,raw: evita la PTY (sin eco ni prompt); los equipos viejos sólo aceptan shell:
+            self._reader, self._writer = await self.client.open_service(self.serial, 'shell,raw:')
+            raw = True
+        except AdbError:
+            self._reader, self._writer = await self.client.open_service(self.serial, 'shell:')
+            raw = False
+        if not raw:
+            await self._execute("stty -echo 2>/dev/null; PS1=''", self.client.timeout)
+
+
+class DeadlineScheduler:
+    """Próximo instante habilitado para enviar de cada dispositivo (reloj monotónico).
+
+    Los plazos viven en un heap y una sola tarea (``run``) duerme hasta el más
+    próximo para liberar al dispositivo que lo espera. Al pausar se congelan
+    y al reanudar se desplazan lo que duró la pausa, así el delay configurado
+    se cumple exacto y sin sondeos.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._deadlines = {}
+        self._waiters = {}
+        self._paused_at = None
+        self._closed = False
+        self._changed = asyncio.Event()
+        self._order = itertools.count()
+
+    def schedule(self, device, delay):
+        """El dispositivo no vuelve a enviar hasta dentro de ``delay`` segundos"""
+        base = self._paused_at if self._paused_at is not None else self.clock()
+        deadline = base + delay
+        self._deadlines[device] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._order), device))
+        self._changed.set()
+
+    async def wait_eligible(self, device):
+        """Esperar a que venza el plazo del dispositivo (o a que se cierre el planificador)"""
+        if self._closed or device not in self._deadlines:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[device] = waiter
+        self._changed.set()
+        await waiter
+
+    def pause(self):
+        if self._paused_at is None:
+            self._paused_at = self.clock()
+
+    def resume(self):
+        if self._paused_at is None:
+            return
+        shift = self.clock() - self._paused_at
+        self._paused_at = None
+        self._deadlines = {device: deadline + shift for device, deadline in self._deadlines.items()}
+        self._heap = [(deadline, next(self._order), device) for device, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+        self._changed.set()
+
+    def close(self):
+        self._closed = True
+        for waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+        self._changed.set()
+
+    def _release_due(self):
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, device = heapq.heappop(self._heap)
+            if self._deadlines.get(device) != deadline:
+                continue  # Entrada vieja: el plazo se reprogramó
+            del self._deadlines[device]
+            waiter = self._waiters.pop(device, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    async def run(self):
+        """Tarea del temporizador: una única espera hasta el próximo plazo"""
+        while not self._closed:
+            self._changed.clear()
+            timeout = None
+            if self._paused_at is None:
+                self._release_due()
+                if self._heap:
+                    timeout = max(0.0, self._heap[0][0] - self.clock())
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class SendControl:
+    """Pausa y cancelación del envío como eventos asyncio, accionables desde Tk"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.stopped = asyncio.Event()
+        self.scheduler = DeadlineScheduler()
+
+    def pause(self):
+        self.loop.call_soon_threadsafe(self._pause)
+
+    def resume(self):
+        self.loop.call_soon_threadsafe(self._resume)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._stop)
+
+    def _pause(self):
+        self.resumed.clear()
+        self.scheduler.pause()
+
+    def _resume(self):
+        self.scheduler.resume()
+        self.resumed.set()
+
+    def _stop(self):
+        self.stopped.set()
+        self.scheduler.close()
+        # Liberar a quien espera la reanudación
+        self.resumed.set()
+
+    @property
+    def is_stopped(self):
+        return self.stopped.is_set()
+
+    async def wait_resumed(self):
+        await self.resumed.wait()
+
+    async def sleep(self, seconds):
+        """Esperar ``seconds`` o hasta cancelar; devuelve True si se canceló"""
+        try:
+            await asyncio.wait_for(self.stopped.wait(), max(0, seconds))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class AsyncLoopThread:
+    """Event loop de asyncio corriendo en su propio hilo"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+READINESS_POLL_INTERVAL = 0.3
+DEVICE_POLL_INTERVAL = 3
+PREFLIGHT_TIMEOUT = 30
+SHUTDOWN_TIMEOUT = 20
+READINESS_SETTLE = 0.8
+
+FOCUS_RE = re.compile(r'mCurrentFocus=Window\{[^}]*?(\S+)\}')
+
+
+def parse_focused_window(dumpsys_output):
+    """Componente con foco (``paquete/actividad``) en la salida de ``dumpsys window``.
+
+    Devuelve '' si no hay ventana con foco y None si la salida no trae el dato.
+    """
+    if 'mCurrentFocus' not in dumpsys_output:
+        return None
+    match = FOCUS_RE.search(dumpsys_output)
+    return match.group(1) if match else ''
+
+
+class DeviceTimingProfiles:
+    """Latencias observadas por dispositivo y tiempos típicos derivados de ellas.
+
+    Guarda las últimas ``window`` muestras de cada paso del envío por serial.
+    Con ``min_samples`` o más, el tiempo típico del paso es el percentil alto
+    más un margen. La espera normal termina cuando el dispositivo está listo
+    (o falla al llegar al máximo configurado); el tiempo típico se usa como
+    espera fija cuando no se puede consultar el foco.
+    """
+
+    STEPS = ('open', 'first_enter')
+
+    def __init__(self, path, window=50, min_samples=5, percentile=0.95, margin=1.5):
+        self.path = path
+        self.window = window
+        self.min_samples = min_samples
+        self.percentile_rank = percentile
+        self.margin = margin
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def _new_profile(self):
+        return {step: deque(maxlen=self.window) for step in self.STEPS}
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for serial, steps in data.items():
+                profile = self._new_profile()
+                for step in self.STEPS:
+                    profile[step].extend(float(value) for value in steps.get(step, []))
+                self._profiles[serial] = profile
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                serial: {step: list(samples) for step, samples in profile.items()}
+                for serial, profile in self._profiles.items()
+            }
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as handle:
+            json.dump(data, handle)
+        os.replace(tmp_path, self.path)
+
+    def record(self, serial, step, seconds):
+        with self._lock:
+            profile = self._profiles.setdefault(serial, self._new_profile())
+            profile[step].append(round(seconds, 2))
+            self._dirty = True
+
+    def samples(self, serial, step):
+        with self._lock:
+            profile = self._profiles.get(serial)
+            return list(profile[step]) if profile else []
+
+    def percentile(self, serial, step):
+        """Percentil alto de las muestras del paso, o None si aún no hay suficientes"""
+        samples = self.samples(serial, step)
+        if len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(self.percentile_rank * len(ordered)))]
+
+    def estimate(self, serial, step, configured):
+        """Tiempo típico del paso en este dispositivo (acotado por lo configurado)"""
+        high = self.percentile(serial, step)
+        if high is None:
+            return configured
+        return min(configured, high + self.margin)
+
+    def serials(self):
+        with self._lock:
+            return sorted(self._profiles)
+
+
+JOURNAL_SENT = 1
+JOURNAL_FAILED = 2
+
+
+class CampaignJournal:
+    """Diario binario de solo-agregado con el resultado de cada envío de una campaña.
+
+    Cabecera con el total y registros fijos de 8 bytes (índice, estado). Un
+    hilo propio los escribe por tandas con fsync, así un corte pierde como
+    mucho el último segundo y el envío nunca espera al disco.
+    """
+
+    MAGIC = b'HERMESJ1'
+    HEADER = struct.Struct('<8sI4x')
+    RECORD = struct.Struct('<IB3x')
+    FLUSH_INTERVAL = 1.0
+    FLUSH_RECORDS = 512
+
+    def __init__(self, path, total):
+        self.path = path
+        self.total = total
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(self.HEADER.pack(self.MAGIC, total))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def record(self, index, status):
+        with self._lock:
+            self._buffer += self.RECORD.pack(index, status)
+            if len(self._buffer) >= self.FLUSH_RECORDS * self.RECORD.size:
+                self._wakeup.set()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                data, self._buffer = self._buffer, bytearray()
+            if data:
+                self._file.write(data)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
+
+    @classmethod
+    def replay(cls, path):
+        """Total y estado final de cada índice (bytearray: 0 pendiente, JOURNAL_*)"""
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        magic, total = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("diario de campaña inválido")
+        # Un registro cortado a la mitad por un corte de luz se descarta
+        end = cls.HEADER.size + (len(data) - cls.HEADER.size) // cls.RECORD.size * cls.RECORD.size
+        records = array('I')
+        records.frombytes(data[cls.HEADER.size:end])
+        if sys.byteorder != 'little':
+            records.byteswap()
+        indexes = records[0::2]
+        statuses = data[cls.HEADER.size + 4:end:cls.RECORD.size]
+        states = bytearray(total)
+        try:
+            # Asignación recorrida en C: 500k registros en unas decenas de ms
+            deque(map(states.__setitem__, indexes, statuses), maxlen=0)
+        except IndexError:
+            raise ValueError("diario de campaña inválido")
+        return total, states
+
+
+def phone_from_url(url):
+    """Teléfono de un enlace wa.me (o '?' si el enlace no tiene ese formato)"""
+    return url.split('wa.me/')[1].split('?')[0] if 'wa.me/' in url else "?"
+
+
+CAMPAIGN_RETENTION_DAYS = 30
+
+
+class CampaignStore:
+    """Base SQLite local con campañas, mensajes e intentos de envío.
+
+    Las escrituras pasan por un hilo propio que agrupa todo lo pendiente en
+    una sola transacción, así el envío nunca espera al disco. Las lecturas
+    usan otra conexión (modo WAL) y no se bloquean con el escritor.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS campaigns (
+            id TEXT PRIMARY KEY,
+            created TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            status TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            campaign_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            phone TEXT NOT NULL,
+            url TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            device TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            updated TEXT,
+            PRIMARY KEY (campaign_id, idx)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS messages_status ON messages (campaign_id, status);
+        CREATE INDEX IF NOT EXISTS messages_device ON messages (device);
+        CREATE INDEX IF NOT EXISTS messages_phone ON messages (phone);
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY,
+            campaign_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            device TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            detail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS attempts_message ON attempts (campaign_id, idx);
+        CREATE INDEX IF NOT EXISTS attempts_device ON attempts (device, ts);
+        CREATE TABLE IF NOT EXISTS contacts (
+            phone INTEGER PRIMARY KEY,
+            last_sent TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS contacts_last_sent ON contacts (last_sent);
+    """
+
+    BATCH_LIMIT = 5000
+
+    def __init__(self, path):
+        self.path = path
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def _write_loop(self):
+        # Transacciones manuales: cada operación va en su propio SAVEPOINT
+        # dentro de la transacción de la tanda
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.BATCH_LIMIT:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                outcomes = self._run_batch(conn, batch)
+            except Exception as exc:
+                # Falló la transacción misma (disco, base bloqueada...)
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            for future, failed, value in outcomes:
+                if failed:
+                    future.set_exception(value)
+                else:
+                    future.set_result(value)
+
+    @staticmethod
+    def _run_batch(conn, batch):
+        """Ejecutar la tanda en una transacción; una operación que falla (con
+        cualquier excepción) se revierte sola sin tirar el resto ni el hilo"""
+        outcomes = []
+        conn.execute("BEGIN")
+        for operation, future in batch:
+            conn.execute("SAVEPOINT operation")
+            try:
+                value = operation(conn)
+            except Exception as exc:
+                conn.execute("ROLLBACK TO operation")
+                outcomes.append((future, True, exc))
+            else:
+                outcomes.append((future, False, value))
+            conn.execute("RELEASE operation")
+        conn.execute("COMMIT")
+        return outcomes
+
+    def _submit(self, operation):
+        future = concurrent.futures.Future()
+        self._queue.put((operation, future))
+        return future
+
+    def _read(self, sql, params=()):
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _now():
+        return datetime.now().isoformat(timespec='seconds')
+
+    def create_campaign(self, total):
+        """Registrar una campaña nueva; el Future devuelve su id"""
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+        def operation(conn):
+            campaign_id, suffix = stamp, 1
+            while conn.execute("SELECT 1 FROM campaigns WHERE id = ?", (campaign_id,)).fetchone():
+                suffix += 1
+                campaign_id = f"{stamp}-{suffix}"
+            conn.execute(
+                "INSERT INTO campaigns (id, created, total, status) VALUES (?, ?, ?, 'preparing')",
+                (campaign_id, self._now(), total)
+            )
+            return campaign_id
+        return self._submit(operation)
+
+    def add_messages(self, campaign_id, links):
+        """Guardar los enlaces de la campaña y dejarla lista para retomarse"""
+        def operation(conn):
+            conn.executemany(
+                "INSERT INTO messages (campaign_id, idx, phone, url) VALUES (?, ?, ?, ?)",
+                ((campaign_id, index, phone_from_url(url), url) for index, url in enumerate(links))
+            )
+            conn.execute("UPDATE campaigns SET status = 'running' WHERE id = ?", (campaign_id,))
+        return self._submit(operation)
+
+    def record_attempt(self, campaign_id, index, device, outcome, status, detail=None):
+        """Registrar un intento y el estado resultante del mensaje"""
+        now = self._now()
+
+        def operation(conn):
+            conn.execute(
+                "INSERT INTO attempts (campaign_id, idx, device, ts, outcome, detail) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (campaign_id, index, device, now, outcome, detail)
+            )
+            conn.execute(
+                "UPDATE messages SET status = ?, device = ?, attempts = attempts + 1, updated = ? "
+                "WHERE campaign_id = ? AND idx = ?",
+                (status, device, now, campaign_id, index)
+            )
+        return self._submit(operation)
+
+    def record_contact(self, phone):
+        """Anotar un envío al teléfono (normalizado) en el historial entre campañas"""
+        now = self._now()
+
+        def operation(conn):
+            conn.execute(
+                "INSERT INTO contacts (phone, last_sent) VALUES (?, ?) "
+                "ON CONFLICT (phone) DO UPDATE SET last_sent = excluded.last_sent",
+                (phone, now)
+            )
+        return self._submit(operation)
+
+    def recent_contacts(self, hours):
+        """Teléfonos que recibieron un mensaje en las últimas ``hours`` horas"""
+        since = (datetime.now() - timedelta(hours=hours)).isoformat(timespec='seconds')
+        with self._read_lock:
+            cursor = self._reader.execute("SELECT phone FROM contacts WHERE last_sent >= ?", (since,))
+            return {row[0] for row in cursor}
+
+    def set_message_status(self, campaign_id, index, status):
+        def operation(conn):
+            conn.execute(
+                "UPDATE messages SET status = ?, updated = ? WHERE campaign_id = ? AND idx = ?",
+                (status, self._now(), campaign_id, index)
+            )
+        return self._submit(operation)
+
+    def set_campaign_status(self, campaign_id, status):
+        def operation(conn):
+            conn.execute("UPDATE campaigns SET status = ? WHERE id = ?", (status, campaign_id))
+        return self._submit(operation)
+
+    def purge_old_campaigns(self, days):
+        """Borrar mensajes e intentos de campañas cerradas hace más de ``days`` días.
+
+        La fila de la campaña queda como resumen; el Future devuelve los ids
+        purgados. Las campañas que todavía pueden retomarse no se tocan.
+        """
+        before = (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+
+        def operation(conn):
+            campaign_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM campaigns WHERE status NOT IN ('preparing', 'running') "
+                "AND created < ? AND EXISTS (SELECT 1 FROM messages WHERE campaign_id = campaigns.id)",
+                (before,)
+            )]
+            for campaign_id in campaign_ids:
+                conn.execute("DELETE FROM messages WHERE campaign_id = ?", (campaign_id,))
+                conn.execute("DELETE FROM attempts WHERE campaign_id = ?", (campaign_id,))
+            return campaign_ids
+        return self._submit(operation)
+
+    def flush(self):
+        """Future que se cumple cuando todo lo encolado hasta ahora está escrito"""
+        return self._submit(lambda conn: None)
+
+    def latest_unfinished(self):
+        """(id, creada, total) de la última campaña que quedó a medias, o None.
+
+        Solo cuenta el estado 'running': las campañas que el usuario canceló
+        ('cancelled') o no quiso retomar ('abandoned') no se ofrecen.
+        """
+        rows = self._read(
+            "SELECT id, created, total FROM campaigns WHERE status = 'running' "
+            "ORDER BY created DESC, id DESC LIMIT 1"
+        )
+        return rows[0] if rows else None
+
+    def message_states(self, campaign_id, total):
+        """Estado de cada mensaje como en el diario (0 pendiente, JOURNAL_*)"""
+        states = bytearray(total)
+        codes = {'sent': JOURNAL_SENT, 'failed': JOURNAL_FAILED}
+        for index, status in self._read(
+            "SELECT idx, status FROM messages WHERE campaign_id = ? AND status != 'pending'",
+            (campaign_id,)
+        ):
+            states[index] = codes.get(status, 0)
+        return states
+
+    def url_page(self, campaign_id, start, count):
+        rows = self._read(
+            "SELECT url FROM messages WHERE campaign_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+            (campaign_id, start, start + count)
+        )
+        return [row[0] for row in rows]
+
+
+class StoredLinks:
+    """Enlaces de una campaña leídos de la base por páginas, con un caché chico"""
+
+    PAGE_SIZE = 500
+    CACHED_PAGES = 8
+
+    def __init__(self, store, campaign_id, total):
+        self.store = store
+        self.campaign_id = campaign_id
+        self.total = total
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError("enlace fuera de rango")
+        page_number, offset = divmod(index, self.PAGE_SIZE)
+        with self._lock:
+            page = self._pages.pop(page_number, None)
+            if page is None:
+                page = self.store.url_page(self.campaign_id, page_number * self.PAGE_SIZE, self.PAGE_SIZE)
+            # Reinsertar deja la página como la más reciente
+            self._pages[page_number] = page
+            if len(self._pages) > self.CACHED_PAGES:
+                del self._pages[next(iter(self._pages))]
+        return page[offset]
+
+    def __iter__(self):
+        for index in range(self.total):
+            yield self[index]
+
+
+FAILURE_TIMEOUT = 'timeout'
+FAILURE_OFFLINE = 'offline'
+FAILURE_APP_MISSING = 'app_missing'
+FAILURE_ERROR = 'error'
+
+FAILURE_LABELS = {
+    FAILURE_TIMEOUT: "Timeout de ADB",
+    FAILURE_OFFLINE: "Dispositivo desconectado",
+    FAILURE_APP_MISSING: "App no instalada",
+    FAILURE_ERROR: "Error",
+}
+
+MAX_SEND_ATTEMPTS = 3
+RETRY_BASE_DELAY = 15
+RETRY_MAX_DELAY = 240
+RETRY_AVOID_GRACE = 30
+
+
+class SendFailure(Exception):
+    """Fallo de un envío, clasificado para decidir si se reintenta y dónde"""
+
+    def __init__(self, kind, detail=''):
+        super().__init__(detail or FAILURE_LABELS[kind])
+        self.kind = kind
+        self.detail = detail
+
+
+def classify_send_error(exc):
+    """Tipo de fallo (``FAILURE_*``) de una excepción producida al enviar"""
+    if isinstance(exc, SendFailure):
+        return exc.kind
+    if isinstance(exc, (subprocess.TimeoutExpired, asyncio.TimeoutError)):
+        return FAILURE_TIMEOUT
+    if isinstance(exc, (AdbError, OSError)):
+        return FAILURE_OFFLINE
+    return FAILURE_ERROR
+
+
+class DispatchQueue:
+    """Cola de trabajo compartida por los workers de cada dispositivo.
+
+    Entrega los índices de los enlaces en orden sin materializarlos; los
+    índices devueltos con ``requeue`` salen antes que los nuevos. Los envíos
+    fallidos esperan aparte (``retry``) con backoff exponencial acotado, así
+    no frenan al resto de la cola, y se prefieren en otro dispositivo.
+    """
+
+    def __init__(self, total, clock=time.monotonic, done=None):
+        self.total = total
+        self.clock = clock
+        # Al retomar, los índices ya confirmados en el diario se saltean
+        self._done = done
+        self._next = 0
+        self._done_ahead = 0
+        if done is not None:
+            first = done.find(0)
+            self._next = total if first == -1 else first
+            self._done_ahead = (total - self._next) - done.count(0, self._next)
+        self._requeued = deque()
+        # Reintentos no vencidos en un heap por vencimiento; al vencer pasan a
+        # una cola por dispositivo a evitar, ya en orden de vencimiento
+        self._retries = []
+        self._ready = {}
+        self._failures = {}
+        self._excluded = {}
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, device=None):
+        """Próximo índice a enviar, o None si no queda trabajo para ``device`` ahora"""
+        with self._lock:
+            index = self._pop_retry(device)
+            if index is not None:
+                return index
+            if self._requeued:
+                return self._requeued.popleft()
+            while self._next < self.total:
+                index = self._next
+                self._next += 1
+                if self._done is not None and self._done[index]:
+                    self._done_ahead -= 1
+                    continue
+                return index
+            return None
+
+    def _release_due(self, now):
+        while self._retries and self._retries[0][0] <= now:
+            entry = heapq.heappop(self._retries)
+            self._ready.setdefault(entry[3], deque()).append(entry)
+
+    def _pop_retry(self, device):
+        now = self.clock()
+        self._release_due(now)
+        chosen = None
+        # Cada cola está ordenada: basta su primera entrada que sirva a ``device``
+        for avoid, entries in self._ready.items():
+            for position, entry in enumerate(entries):
+                if device in entry[4]:
+                    continue
+                # Primero otro dispositivo; el mismo sólo si nadie lo tomó a tiempo
+                if avoid == device and now - entry[0] < RETRY_AVOID_GRACE:
+                    break
+                if chosen is None or entry[:2] < chosen[0][:2]:
+                    chosen = (entry, avoid, position)
+                break
+        if chosen is None:
+            return None
+        entry, avoid, position = chosen
+        entries = self._ready[avoid]
+        del entries[position]
+        if not entries:
+            del self._ready[avoid]
+        return entry[2]
+
+    def requeue(self, index):
+        with self._lock:
+            self._requeued.append(index)
+
+    def retry(self, index, kind, device):
+        """Programar un reintento; devuelve la espera en segundos o None si se agotaron los intentos"""
+        with self._lock:
+            failures = self._failures[index] = self._failures.get(index, 0) + 1
+            if failures >= MAX_SEND_ATTEMPTS:
+                return None
+            excluded = self._excluded.setdefault(index, set())
+            if kind == FAILURE_APP_MISSING:
+                excluded.add(device)
+            avoid = device if kind in (FAILURE_TIMEOUT, FAILURE_OFFLINE) else None
+            delay = min(RETRY_BASE_DELAY * 2 ** (failures - 1), RETRY_MAX_DELAY)
+            heapq.heappush(
+                self._retries,
+                (self.clock() + delay, next(self._order), index, avoid, frozenset(excluded))
+            )
+            return delay
+
+    def attempts(self, index):
+        with self._lock:
+            return self._failures.get(index, 0) + 1
+
+    def retry_wait(self, device):
+        """Segundos hasta que ``device`` pueda tomar un reintento, o None si no hay ninguno para él"""
+        with self._lock:
+            now = self.clock()
+            waits = [
+                (due + RETRY_AVOID_GRACE if avoid == device else due) - now
+                for due, _, _, avoid, excluded in self._all_retries()
+                if device not in excluded
+            ]
+            return max(0.0, min(waits)) if waits else None
+
+    def drop_unservable(self, devices):
+        """Quitar los reintentos que ningún dispositivo de ``devices`` puede hacer"""
+        devices = set(devices)
+        if not devices:
+            return []
+        with self._lock:
+            dropped = [entry for entry in self._all_retries() if devices <= entry[4]]
+            if dropped:
+                self._retries = [entry for entry in self._retries if not devices <= entry[4]]
+                heapq.heapify(self._retries)
+                for avoid in list(self._ready):
+                    entries = deque(entry for entry in self._ready[avoid] if not devices <= entry[4])
+                    if entries:
+                        self._ready[avoid] = entries
+                    else:
+                        del self._ready[avoid]
+            return [entry[2] for entry in dropped]
+
+    def _all_retries(self):
+        return itertools.chain(self._retries, *self._ready.values())
+
+    def pending(self):
+        with self._lock:
+            retries = len(self._retries) + sum(map(len, self._ready.values()))
+            return len(self._requeued) + retries + self.total - self._next - self._done_ahead
+
+
 class Hermes:
     def __init__(self, root):
         self.root = root
@@ -359,6 +2858,7 @@ class Hermes:
         self.delay_max = tk.IntVar(value=15)
         self.wait_after_open = tk.IntVar(value=15)
         self.wait_after_first_enter = tk.IntVar(value=10)
+        self.contact_cap_hours = tk.IntVar(value=48)
         
         self.excel_file = ""
         self.links = []
@@ -367,6 +2867,25 @@ class Hermes:
         self.is_paused = False
         self.should_stop = False
         self.pause_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.adb_client = AdbClient()
+        self.adb_native = False
+        self.adb_sessions = {}
+        self.send_loop = None
+        self.campaign_future = None
+        self.send_control = None
+        self.campaign_devices = []
+        self.worker_tasks = {}
+        self.pool_changed = None
+        self.unready_devices = set()
+        self.campaign_dir = hermes_data_dir('campanas')
+        self.campaign_store = CampaignStore(os.path.join(hermes_data_dir(), 'hermes.db'))
+        self.campaign_id = None
+        self.campaign_links = None
+        self.journal = None
+        self.pending_resume = None
+        self.ui_queue = queue.Queue()
+        self._stats_posted = False
         
         self.total_messages = 0
         self.sent_count = 0
@@ -381,10 +2900,13 @@ class Hermes:
         self.manual_loops = 1
 
         # Variables del procesador
-        self.raw_data = []
+        self.raw_data = ColumnarDataset([])
         self.columns = []
         self.selected_columns = []
         self.phone_columns = []
+        self.dataset_cache = DatasetCache(hermes_data_dir('cache'))
+        self.timing_profiles = DeviceTimingProfiles(os.path.join(hermes_data_dir(), 'tiempos.json'))
+        self.suppression = SuppressionList(hermes_data_dir('bajas'))
 
         # Fidelizado
         self.fidelizado_unlocked = False
@@ -408,8 +2930,15 @@ class Hermes:
             'action_cancel': '#DC2626',
         }
         
+        self.log_sink = LogSink(self.root, os.path.join(hermes_data_dir('logs'), 'hermes.log'))
         self.setup_ui()
+        self.log_sink.attach(self.log_text)
         self.auto_detect_adb()
+        self.root.after(100, self._drain_ui_queue)
+        self.root.after(500, self.offer_resume)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.campaign_store.purge_old_campaigns(CAMPAIGN_RETENTION_DAYS).add_done_callback(
+            self._remove_purged_journals)
         
     def setup_ui(self):
         """Configurar interfaz"""
@@ -529,6 +3058,20 @@ class Hermes:
         tk.Label(config_title, text="Configuración de Tiempo",
                 font=('Inter', 16, 'bold'),
                 bg=self.colors['bg'], fg='#000000').pack(side=tk.LEFT)
+
+        tk.Button(
+            config_title,
+            text="⏱ Perfiles",
+            command=self.show_timing_profiles,
+            bg='#ffffff', fg=self.colors['text'],
+            font=('Inter', 10, 'bold'),
+            relief=tk.RAISED, cursor='hand2',
+            activebackground='#e5e7eb',
+            bd=1, padx=6, pady=2,
+            highlightthickness=1,
+            highlightbackground='#c8ccd5',
+            highlightcolor='#c8ccd5'
+        ).pack(side=tk.LEFT, padx=(12, 0))
         
         tk.Frame(parent, bg='#e0e0e0', height=1).pack(fill=tk.X, pady=(0, 25))
         
@@ -538,10 +3081,12 @@ class Hermes:
         
         self.create_setting(settings, "Delay entre mensajes (seg):",
                           self.delay_min, self.delay_max, 0)
-        self.create_setting(settings, "Espera después de abrir (seg):",
+        self.create_setting(settings, "Espera máx. después de abrir (seg):",
                           self.wait_after_open, None, 1)
-        self.create_setting(settings, "Espera después del 1er ENTER (seg):",
+        self.create_setting(settings, "Espera máx. después del 1er ENTER (seg):",
                           self.wait_after_first_enter, None, 2)
+        self.create_setting(settings, "Frecuencia máx. por número (1 cada N horas):",
+                          self.contact_cap_hours, None, 3)
         
         # Acciones
         actions_title = tk.Frame(parent, bg=self.colors['bg'])
@@ -585,6 +3130,20 @@ class Hermes:
             highlightcolor='#c8ccd5'
         )
         self.fidelizado_unlock_btn.pack()
+
+        tk.Button(
+            actions_title,
+            text="🚫 Bajas",
+            command=self.import_suppression_list,
+            bg='#ffffff', fg=self.colors['text'],
+            font=('Inter', 10, 'bold'),
+            relief=tk.RAISED, cursor='hand2',
+            activebackground='#e5e7eb',
+            bd=1, padx=6, pady=2,
+            highlightthickness=1,
+            highlightbackground='#c8ccd5',
+            highlightcolor='#c8ccd5'
+        ).pack(side=tk.LEFT, padx=(8, 0))
         
         tk.Frame(parent, bg='#e0e0e0', height=1).pack(fill=tk.X, pady=(0, 25))
         
@@ -868,6 +3427,122 @@ class Hermes:
         elif label == "Progreso":
             self.stat_progress = val_label
             
+    def show_timing_profiles(self):
+        """Ventana con los tiempos aprendidos por dispositivo"""
+        window = tk.Toplevel(self.root)
+        window.title("Perfiles de tiempo por dispositivo")
+        window.configure(bg=self.colors['bg'])
+        window.transient(self.root)
+        window.geometry("720x320")
+
+        content = tk.Frame(window, bg='#ffffff')
+        content.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
+
+        tk.Label(
+            content,
+            text=(
+                "Percentil 95 de las últimas latencias medidas y el tiempo típico estimado. "
+                "La espera de cada paso termina cuando el dispositivo está listo o al llegar "
+                "a la espera máxima configurada; si no se puede consultar el foco, se espera "
+                "el tiempo típico."
+            ),
+            font=('Inter', 10),
+            bg='#ffffff', fg=self.colors['text_light'],
+            wraplength=660, justify='left'
+        ).pack(anchor='w', padx=12, pady=(12, 8))
+
+        columns = ('device', 'samples', 'open_p95', 'open_estimate', 'enter_p95', 'enter_estimate')
+        headings = ("Dispositivo", "Muestras", "P95 apertura", "Típico apertura",
+                    "P95 1er ENTER", "Típico 1er ENTER")
+        tree = ttk.Treeview(content, columns=columns, show='headings', height=8)
+        for column, heading in zip(columns, headings):
+            tree.heading(column, text=heading)
+            tree.column(column, width=150 if column == 'device' else 105, anchor='center')
+        tree.pack(fill=tk.BOTH, expand=True, padx=12, pady=(0, 12))
+
+        def _fmt(value):
+            return "—" if value is None else f"{value:.1f}s"
+
+        profiles = self.timing_profiles
+        for serial in profiles.serials():
+            tree.insert('', tk.END, values=(
+                serial,
+                len(profiles.samples(serial, 'open')),
+                _fmt(profiles.percentile(serial, 'open')),
+                _fmt(profiles.estimate(serial, 'open', self.wait_after_open.get())),
+                _fmt(profiles.percentile(serial, 'first_enter')),
+                _fmt(profiles.estimate(serial, 'first_enter', self.wait_after_first_enter.get())),
+            ))
+        if not profiles.serials():
+            tree.insert('', tk.END, values=("Sin datos todavía", "", "", "", "", ""))
+
+    def import_suppression_list(self):
+        """Agregar un .txt o .csv de números a la lista de bajas"""
+        file_path = filedialog.askopenfilename(
+            title="Seleccionar lista de bajas",
+            filetypes=[("Texto o CSV", "*.txt *.csv"), ("Todos", "*.*")]
+        )
+        if not file_path:
+            return
+
+        task = None
+
+        def cancel():
+            if task:
+                task.cancel()
+
+        dialog = ProgressDialog(self.root, "Lista de bajas",
+                                f"🚫 Importando {os.path.basename(file_path)}...",
+                                on_cancel=cancel, bg=self.colors['bg'])
+
+        def work(report, cancel_event):
+            def progress(numbers_read):
+                if cancel_event.is_set():
+                    raise OperationCancelled()
+                report(numbers_read)
+
+            return self.suppression.import_file(file_path, progress)
+
+        def on_progress(numbers_read):
+            dialog.update(text=f"🚫 Importando {os.path.basename(file_path)}: {numbers_read:,} números")
+
+        def on_done(result):
+            dialog.close()
+            numbers_read, added, unparsed = result
+            self.log(f"🚫 Lista de bajas: {added} números nuevos de {numbers_read} leídos "
+                     f"({len(self.suppression)} en total)", 'success')
+            if unparsed:
+                self.log(f"⚠ Lista de bajas: {unparsed} líneas sin un número reconocible "
+                         "(encabezados o formatos no válidos)", 'warning')
+
+        def on_error(exc):
+            dialog.close()
+            if isinstance(exc, OperationCancelled):
+                self.log("⚠ Importación cancelada (las tandas ya leídas quedaron agregadas)", 'warning')
+                return
+            self.log(f"✗ Error al importar la lista de bajas: {exc}", 'error')
+            messagebox.showerror("Error", f"Error al importar la lista de bajas: {exc}")
+
+        task = BackgroundTask(self.root, work, on_progress=on_progress,
+                              on_done=on_done, on_error=on_error).start()
+
+    def make_link_filter(self):
+        """Filtro con la lista de bajas y el tope de frecuencia configurado"""
+        try:
+            hours = self.contact_cap_hours.get()
+        except (tk.TclError, ValueError):
+            hours = 0
+        recent = self.campaign_store.recent_contacts(hours) if hours > 0 else None
+        return LinkFilter(self.suppression, recent)
+
+    def log_link_filter(self, link_filter):
+        """Informar cuántos números se omitieron y por qué"""
+        if link_filter.suppressed:
+            self.log(f"🚫 {link_filter.suppressed} números omitidos por estar en la lista de bajas", 'warning')
+        if link_filter.capped:
+            self.log(f"⏳ {link_filter.capped} mensajes omitidos por el tope de 1 mensaje por número "
+                     f"cada {self.contact_cap_hours.get()} h (contando repetidos en esta carga)", 'warning')
+
     def create_setting(self, parent, label, var1, var2, row):
         """Crear fila de configuración"""
         tk.Label(parent, text=label,
@@ -894,11 +3569,8 @@ class Hermes:
             combo2.pack(side=tk.LEFT)
             
     def log(self, msg, tag='info'):
-        """Agregar al log"""
-        ts = datetime.now().strftime("[%H:%M:%S]")
-        self.log_text.insert(tk.END, f"{ts} {msg}\n", tag)
-        self.log_text.see(tk.END)
-        self.root.update()
+        """Agregar al log (desde cualquier hilo; se muestra en la próxima tanda)"""
+        self.log_sink.write(msg, tag)
         
     def update_stats(self):
         """Actualizar estadísticas"""
@@ -943,12 +3615,16 @@ class Hermes:
         self.log("🔍 Detectando dispositivos...", 'info')
         
         try:
-            result = subprocess.run([adb, 'devices'], capture_output=True,
-                                   text=True, timeout=10)
-            self.devices = []
-            for line in result.stdout.strip().split('\n')[1:]:
-                if '\tdevice' in line:
-                    self.devices.append(line.split('\t')[0])
+            try:
+                listing = self.adb_client.devices()
+                self.adb_native = True
+            except (OSError, AdbError):
+                # Servidor ADB no iniciado: adb.exe lo levanta y la próxima vez se usa el protocolo directo
+                self.adb_native = False
+                result = subprocess.run([adb, 'devices'], capture_output=True,
+                                       text=True, timeout=10)
+                listing = parse_device_listing(result.stdout)
+            self.devices = [serial for serial, state in listing if state == 'device']
                     
             if self.devices:
                 self.log(f"✓ {len(self.devices)} dispositivo(s) encontrado(s)", 'success')
@@ -957,70 +3633,35 @@ class Hermes:
         except Exception as e:
             self.log(f"✗ Error: {e}", 'error')
     
-    def read_csv_file(self, filepath):
-        """Leer archivo CSV con detección de codificación y soporte completo para emojis"""
+    def _log_read_stats(self, reader, log):
+        """Registrar el rendimiento de una lectura en streaming"""
+        log(
+            f"⚡ {reader.rows_read} filas en {reader.elapsed:.1f}s "
+            f"({reader.rows_per_second:,.0f} filas/s)",
+            'info'
+        )
+
+    def read_csv_file(self, filepath, progress_callback=None, log=None):
+        """Leer archivo CSV en streaming con detección real de codificación"""
         try:
-            # Priorizar UTF-8 para emojis
-            encodings = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252', 'iso-8859-1', 'utf-16']
-            
-            for encoding in encodings:
-                try:
-                    with open(filepath, 'r', encoding=encoding, errors='ignore') as file:
-                        sample = file.read(2048)
-                        file.seek(0)
-                        
-                        delimiters = [';', ',', '\t', '|']
-                        delimiter = ','
-                        for delim in delimiters:
-                            if delim in sample:
-                                delimiter = delim
-                                break
-                        
-                        reader = csv.DictReader(file, delimiter=delimiter)
-                        data = []
-                        for row in reader:
-                            clean_row = {}
-                            for key, value in row.items():
-                                if key is not None:
-                                    clean_key = key.strip()
-                                    # Preservar emojis y caracteres especiales
-                                    clean_value = value if value is not None else ''
-                                    clean_row[clean_key] = clean_value
-                            data.append(clean_row)
-                        
-                        fieldnames = [name.strip() for name in reader.fieldnames if name is not None] if reader.fieldnames else []
-                        return data, fieldnames
-                except:
-                    continue
-            
-            raise Exception("No se pudo leer el archivo CSV con ninguna codificación")
+            reader = CSVStreamReader(filepath, progress_callback=progress_callback)
+            data = ColumnarDataset.from_chunks(reader.fieldnames, reader.iter_chunks())
+            self._log_read_stats(reader, log or self.log)
+            return data, reader.fieldnames
+        except OperationCancelled:
+            raise
         except Exception as e:
             raise Exception(f"Error al leer archivo CSV: {str(e)}")
     
-    def read_excel_file(self, filepath):
-        """Leer archivo Excel usando openpyxl"""
+    def read_excel_file(self, filepath, progress_callback=None, log=None):
+        """Leer archivo Excel en streaming (lector XLSX directo u openpyxl)"""
         try:
-            workbook = load_workbook(filepath, data_only=True)
-            sheet = workbook.active
-            
-            headers = []
-            for cell in sheet[1]:
-                headers.append(str(cell.value).strip() if cell.value is not None else '')
-            
-            data = []
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                row_dict = {}
-                for col_idx, value in enumerate(row):
-                    if col_idx < len(headers) and headers[col_idx]:
-                        if value is None or value == '':
-                            row_dict[headers[col_idx]] = ''
-                        elif isinstance(value, (int, float)):
-                            row_dict[headers[col_idx]] = str(value)
-                        else:
-                            row_dict[headers[col_idx]] = str(value)
-                data.append(row_dict)
-            
-            return data, headers
+            reader = open_excel_stream(filepath, progress_callback=progress_callback)
+            data = ColumnarDataset.from_chunks(reader.fieldnames, reader.iter_chunks())
+            self._log_read_stats(reader, log or self.log)
+            return data, reader.fieldnames
+        except OperationCancelled:
+            raise
         except Exception as e:
             raise Exception(f"Error al leer archivo Excel: {str(e)}")
     
@@ -1038,44 +3679,94 @@ class Hermes:
         if not file_path:
             return
         
-        try:
-            self.log("📖 Leyendo archivo...", 'info')
+        self.log("📖 Leyendo archivo...", 'info')
+        self.btn_load.configure(state=tk.DISABLED)
+        task = None
+        
+        def cancel():
+            if task:
+                task.cancel()
+        
+        dialog = ProgressDialog(self.root, "Leyendo archivo",
+                                f"📖 Leyendo {os.path.basename(file_path)}...",
+                                on_cancel=cancel, bg=self.colors['bg'])
+        
+        def work(report, cancel_event):
+            def progress(rows_read):
+                if cancel_event.is_set():
+                    raise OperationCancelled()
+                report(rows_read)
+            
+            cached = self.dataset_cache.load(file_path)
+            if cached is not None:
+                task.log(f"⚡ {len(cached)} filas cargadas desde la caché", 'info')
+                return cached, cached.columns
             
             if file_path.lower().endswith('.csv'):
-                self.raw_data, self.columns = self.read_csv_file(file_path)
+                result = self.read_csv_file(file_path, progress, task.log)
             else:
-                self.raw_data, self.columns = self.read_excel_file(file_path)
+                result = self.read_excel_file(file_path, progress, task.log)
             
-            # DETECCIÓN INTELIGENTE: Verificar si ya tiene URLs
-            if 'URL' in self.columns or 'url' in self.columns:
-                # Excel ya procesado con URLs
-                url_col = 'URL' if 'URL' in self.columns else 'url'
-                self.links = [row[url_col] for row in self.raw_data if row.get(url_col)]
-                
-                if self.links:
-                    self.total_messages = len(self.links)
-                    self.update_stats()
-                    self.log(f"✓ Excel con URLs cargado: {len(self.links)} URLs detectados", 'success')
-                    messagebox.showinfo("Excel Cargado", 
-                                      f"Se detectaron {len(self.links)} URLs de WhatsApp\n\n"
-                                      "Puedes iniciar el envío directamente.")
-                    return
-            
-            # Excel original sin URLs - procesar normalmente
-            self.phone_columns = [col for col in self.columns if col and 'telefono' in col.lower()]
-            
-            if not self.phone_columns:
-                messagebox.showerror("Error", "No se encontraron columnas de teléfono en el archivo")
+            try:
+                self.dataset_cache.store(file_path, result[0])
+            except OSError as e:
+                task.log(f"⚠ No se pudo guardar la caché: {e}", 'warning')
+            return result
+        
+        def on_progress(rows_read):
+            dialog.update(text=f"📖 Leyendo {os.path.basename(file_path)}: {rows_read:,} filas")
+        
+        def on_done(result):
+            dialog.close()
+            self.btn_load.configure(state=tk.NORMAL)
+            self.raw_data, self.columns = result
+            self.on_file_loaded(file_path)
+        
+        def on_error(exc):
+            dialog.close()
+            self.btn_load.configure(state=tk.NORMAL)
+            if isinstance(exc, OperationCancelled):
+                self.log("⚠ Lectura cancelada", 'warning')
                 return
+            self.log(f"✗ Error al leer archivo: {exc}", 'error')
+            messagebox.showerror("Error", f"Error al leer archivo: {exc}")
+        
+        # ``task`` tiene que existir antes de arrancar: ``work`` lo usa para el log
+        task = BackgroundTask(self.root, work, on_progress=on_progress,
+                              on_done=on_done, on_error=on_error, on_log=self.log)
+        task.start()
+
+    def on_file_loaded(self, file_path):
+        """Continuar con el archivo ya leído: URLs directos o ventana de procesamiento"""
+        # DETECCIÓN INTELIGENTE: Verificar si ya tiene URLs
+        if 'URL' in self.columns or 'url' in self.columns:
+            # Excel ya procesado con URLs
+            url_col = 'URL' if 'URL' in self.columns else 'url'
+            link_filter = self.make_link_filter()
+            self.links = [url for url in self.raw_data.column(url_col)
+                          if url and link_filter.allows(phone_from_url(url))]
+            self.log_link_filter(link_filter)
             
-            self.log(f"✓ Archivo leído: {len(self.raw_data)} filas, {len(self.columns)} columnas", 'success')
-            self.log(f"✓ Columnas de teléfono: {', '.join(self.phone_columns)}", 'success')
-            
-            self.open_processor_window(file_path)
-            
-        except Exception as e:
-            self.log(f"✗ Error al leer archivo: {e}", 'error')
-            messagebox.showerror("Error", f"Error al leer archivo: {e}")
+            if self.links:
+                self.total_messages = len(self.links)
+                self.update_stats()
+                self.log(f"✓ Excel con URLs cargado: {len(self.links)} URLs detectados", 'success')
+                messagebox.showinfo("Excel Cargado", 
+                                  f"Se detectaron {len(self.links)} URLs de WhatsApp\n\n"
+                                  "Puedes iniciar el envío directamente.")
+                return
+        
+        # Excel original sin URLs - procesar normalmente
+        self.phone_columns = [col for col in self.columns if col and 'telefono' in col.lower()]
+        
+        if not self.phone_columns:
+            messagebox.showerror("Error", "No se encontraron columnas de teléfono en el archivo")
+            return
+        
+        self.log(f"✓ Archivo leído: {len(self.raw_data)} filas, {len(self.columns)} columnas", 'success')
+        self.log(f"✓ Columnas de teléfono: {', '.join(self.phone_columns)}", 'success')
+        
+        self.open_processor_window(file_path)
 
     def _show_fidelizado_trigger(self):
         """Mostrar el botón Fidelizado respetando la sombra"""
@@ -1418,28 +4109,18 @@ class Hermes:
         if not numbers or not messages:
             return []
 
-        count = len(numbers)
-        base_sequence = []
-        for number in numbers:
-            base_sequence.extend([number] * count)
-
-        if not base_sequence:
+        # Fidelizado repite a propósito los mismos números: solo la lista de bajas
+        link_filter = LinkFilter(self.suppression)
+        numbers = [number for number in numbers if link_filter.allows(number)]
+        self.log_link_filter(link_filter)
+        if not numbers:
             return []
 
-        loops = max(1, loops)
-        total_messages = len(messages)
-        block_size = len(base_sequence)
-        required_repeats = -(-total_messages // block_size)
-        repeats = max(loops, required_repeats)
-
-        full_sequence = (base_sequence * repeats)[:total_messages]
-
-        links = []
-        for number, message in zip(full_sequence, messages):
-            encoded_message = urllib.parse.quote(message, safe='')
-            links.append(f"https://wa.me/549{number}?text={encoded_message}")
-
-        return links
+        # El bloque base (cada número repetido len(numbers) veces) se repite
+        # hasta cubrir los mensajes y se corta ahí: ``loops`` nunca cambia el
+        # resultado y el orden lo calcula FidelizadoSchedule sin listas.
+        schedule = FidelizadoSchedule(numbers, len(messages))
+        return ManualLinkSource(schedule, messages)
 
     def open_processor_window(self, original_file):
         """Ventana de configuración con colores y tipografía de Hermes"""
@@ -1739,30 +4420,12 @@ class Hermes:
                     preview_text.config(state=tk.DISABLED)
                     return
                 
-                # Usar la primera fila de datos como ejemplo
+                # Usar la primera fila de datos como ejemplo, con la misma
+                # plantilla compilada que usa process_excel_data
                 if self.raw_data:
-                    example_row = self.raw_data[0]
-                    preview_message = current_message
-                    
-                    # Reemplazar cada placeholder con datos reales
-                    for col in self.columns:
-                        placeholder = f"{{{col}}}"
-                        if placeholder in preview_message:
-                            value = example_row.get(col, '')
-                            if value is None:
-                                value = ''
-                            
-                            # Formatear como peso si es necesario
-                            if '$ Hist.' in col or '$ Asig.' in col:
-                                try:
-                                    num_value = float(str(value).replace(',', '').replace('$', '').strip())
-                                    value = f"${num_value:,.2f}"
-                                except:
-                                    value = str(value)
-                            else:
-                                value = str(value)
-                            
-                            preview_message = preview_message.replace(placeholder, value)
+                    selected = [col for col, var in self.column_vars.items() if var.get()]
+                    template = MessageTemplate(current_message, selected)
+                    preview_message = template.render(self.raw_data[0])
                     
                     preview_text.config(state=tk.NORMAL)
                     preview_text.delete('1.0', tk.END)
@@ -1817,6 +4480,7 @@ class Hermes:
         
         for var in self.column_vars.values():
             var.trace('w', lambda *args: update_buttons())
+            var.trace('w', update_preview)
         
         update_buttons()
         
@@ -1886,83 +4550,66 @@ class Hermes:
     
     def process_excel_data(self, selected_columns, message_template, selected_phones):
         """Procesar datos y generar URLs"""
-        processed_rows = []
-        
-        for row in self.raw_data:
-            phone_numbers = []
-            
-            for phone_col in selected_phones:
-                phone_value = str(row.get(phone_col, '')) if row.get(phone_col) else ''
-                numbers = [num.strip() for num in phone_value.split('-') if num.strip()]
-                phone_numbers.extend(numbers)
-            
-            if not phone_numbers:
-                continue
-            
-            for phone in phone_numbers:
-                if phone and phone.strip():
-                    message = message_template
-                    for col in selected_columns:
-                        placeholder = f"{{{col}}}"
-                        value = row.get(col, '')
-                        if value is None:
-                            value = ''
-                        
-                        # Formatear como peso si la columna contiene "$ Hist." o "$ Asig."
-                        if '$ Hist.' in col or '$ Asig.' in col:
-                            try:
-                                # Convertir a número y formatear como peso
-                                num_value = float(str(value).replace(',', '').replace('$', '').strip())
-                                value = f"${num_value:,.2f}"
-                            except:
-                                value = str(value)
-                        else:
-                            value = str(value)
-                        
-                        message = message.replace(placeholder, value)
-                    
-                    phone_clean = phone.strip()
-                    # Codificar mensaje preservando emojis (safe='' para codificar todo excepto caracteres seguros)
-                    encoded_message = urllib.parse.quote(message, safe='')
-                    whatsapp_url = f"https://wa.me/549{phone_clean}?text={encoded_message}"
-                    
-                    processed_rows.append(whatsapp_url)
-        
-        self.links = processed_rows
+        template = MessageTemplate(message_template, selected_columns)
+        # Conservar solo las columnas que se usan: teléfonos y campos de la plantilla
+        self.raw_data = self.raw_data.project(list(selected_phones) + template.fields)
+        # Los enlaces se arman recién cuando el envío los pide
+        link_filter = self.make_link_filter()
+        self.links = RowLinkSource(self.raw_data, template, selected_phones, link_filter)
         self.total_messages = len(self.links)
         self.update_stats()
 
         self.log(f"✓ {len(self.links)} URLs de WhatsApp generados", 'success')
+        self.log_link_filter(link_filter)
 
         if not self.manual_mode:
             self.save_processed_excel()
     
     def save_processed_excel(self):
-        """Guardar Excel con URLs"""
-        try:
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "URLs WhatsApp"
-            
-            ws['A1'] = 'URL'
-            
-            for idx, url in enumerate(self.links, start=2):
-                ws[f'A{idx}'] = url
-            
-            output_path = filedialog.asksaveasfilename(
-                defaultextension=".xlsx",
-                filetypes=[("Excel", "*.xlsx")],
-                title="Guardar Excel Procesado"
-            )
-            
-            if output_path:
-                wb.save(output_path)
-                self.log(f"✓ Excel guardado: {os.path.basename(output_path)}", 'success')
-                messagebox.showinfo("Éxito", f"Excel procesado guardado correctamente\n{len(self.links)} URLs listos para enviar")
+        """Guardar URLs procesados en Excel o CSV (en segundo plano)"""
+        output_path = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel", "*.xlsx"), ("CSV (más rápido)", "*.csv")],
+            title="Guardar Excel Procesado"
+        )
         
-        except Exception as e:
-            self.log(f"✗ Error al guardar Excel: {e}", 'error')
-            messagebox.showerror("Error", f"Error al guardar Excel: {e}")
+        if not output_path:
+            return
+        
+        links = self.links
+        total = len(links)
+        task = None
+        
+        def cancel():
+            if task:
+                task.cancel()
+        
+        dialog = ProgressDialog(self.root, "Guardando", f"💾 Guardando {total} URLs...",
+                                maximum=total, on_cancel=cancel, bg=self.colors['bg'])
+        
+        def on_progress(written):
+            dialog.update(written, f"💾 Guardando URLs: {written}/{total}")
+        
+        def on_done(written):
+            dialog.close()
+            self.log(f"✓ Archivo guardado: {os.path.basename(output_path)}", 'success')
+            messagebox.showinfo("Éxito", f"Archivo procesado guardado correctamente\n{written} URLs listos para enviar")
+        
+        def on_error(exc):
+            dialog.close()
+            if isinstance(exc, OperationCancelled):
+                self.log("⚠ Guardado cancelado", 'warning')
+                return
+            self.log(f"✗ Error al guardar archivo: {exc}", 'error')
+            messagebox.showerror("Error", f"Error al guardar archivo: {exc}")
+        
+        task = BackgroundTask(
+            self.root,
+            lambda report, cancel_event: export_links(links, output_path, report, cancel_event),
+            on_progress=on_progress,
+            on_done=on_done,
+            on_error=on_error
+        ).start()
             
     def start_sending(self):
         """Iniciar envío"""
@@ -1977,11 +4624,21 @@ class Hermes:
             return
         if self.is_running:
             return
+        
+        resume = self.pending_resume
+        if resume and resume['links'] is not self.links:
+            # Se cargaron otros datos después de elegir retomar
+            resume = self.pending_resume = None
             
-        if not messagebox.askyesno("Confirmar",
-            f"¿Iniciar envío de {len(self.links)} mensajes?"):
+        if resume:
+            pending = resume['states'].count(0)
+            question = f"¿Retomar la campaña {resume['campaign_id']} ({pending} mensajes pendientes)?"
+        else:
+            question = f"¿Iniciar envío de {len(self.links)} mensajes?"
+        if not messagebox.askyesno("Confirmar", question):
             return
             
+        self.pending_resume = None
         self.is_running = True
         self.is_paused = False
         self.should_stop = False
@@ -1994,17 +4651,24 @@ class Hermes:
         self.btn_pause.config(state=tk.NORMAL)
         self.btn_stop.config(state=tk.NORMAL)
         
-        threading.Thread(target=self.send_thread, daemon=True).start()
+        if self.send_loop is None:
+            self.send_loop = AsyncLoopThread()
+        self.campaign_future = self.send_loop.submit(self.run_campaign(resume))
         
     def pause_sending(self):
         """Pausar/Reanudar"""
         with self.pause_lock:
+            control = self.send_control
             if self.is_paused:
                 self.is_paused = False
+                if control:
+                    control.resume()
                 self.btn_pause.config(text="⏸  PAUSAR")
                 self.log("▶ Reanudado", 'success')
             else:
                 self.is_paused = True
+                if control:
+                    control.pause()
                 self.btn_pause.config(text="▶  REANUDAR")
                 self.log("⏸ Pausado", 'warning')
                 
@@ -2012,139 +4676,656 @@ class Hermes:
         """Cancelar"""
         if messagebox.askyesno("Confirmar", "¿Cancelar el envío?"):
             self.should_stop = True
+            if self.send_control:
+                self.send_control.stop()
             self.log("⏹ Cancelando...", 'warning')
+
+    def call_in_ui(self, func, *args):
+        """Encolar una llamada para el hilo de Tk (desde el motor de envío)"""
+        self.ui_queue.put((func, args))
+
+    def post_log(self, msg, tag='info'):
+        self.log(msg, tag)
+
+    def post_stats(self):
+        """Pedir al hilo de Tk que refresque las estadísticas; los pedidos que
+        llegan antes del próximo drenado se juntan en uno solo"""
+        if not self._stats_posted:
+            self._stats_posted = True
+            self.call_in_ui(self._refresh_stats)
+
+    def _refresh_stats(self):
+        self._stats_posted = False
+        self.update_stats()
+
+    def _drain_ui_queue(self):
+        while True:
+            try:
+                func, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+        self.root.after(100, self._drain_ui_queue)
+
+    def on_close(self):
+        """Cerrar la ventana; con un envío en curso, detenerlo y esperar su cierre ordenado"""
+        future = self.campaign_future
+        if future is None or future.done():
+            self._shutdown()
+            return
+        if not messagebox.askyesno("Envío en curso",
+                                   "Hay un envío en curso. ¿Detenerlo y cerrar Hermes?"):
+            return
+        self.should_stop = True
+        if self.send_control:
+            self.send_control.stop()
+        self.log("⏹ Cerrando: esperando a que el envío se detenga...", 'warning')
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+
+        # El ``finally`` de run_campaign cierra el diario, la base y las sesiones
+        def wait_campaign():
+            if future.done() or time.monotonic() >= deadline:
+                self._shutdown()
+            else:
+                self.root.after(100, wait_campaign)
+        wait_campaign()
+
+    def _shutdown(self):
+        """Dejar en disco lo pendiente y destruir la ventana"""
+        future = self.campaign_future
+        if future is not None and not future.done():
+            # La campaña no terminó a tiempo: guardar lo que haya sin esperarla
+            journal = self.journal
+            if journal is not None:
+                journal.flush()
+            try:
+                self.send_loop.submit(self.close_adb_sessions()).result(timeout=3)
+            except Exception:
+                pass
+        try:
+            self.campaign_store.flush().result(timeout=5)
+        except (concurrent.futures.TimeoutError, sqlite3.Error):
+            pass
+        try:
+            self.timing_profiles.save()
+        except OSError:
+            pass
+        self.root.destroy()
+
+    def _on_campaign_finished(self):
+        self.send_control = None
+        self.is_running = False
+        self.btn_start.config(state=tk.NORMAL)
+        self.btn_pause.config(state=tk.DISABLED)
+        self.btn_stop.config(state=tk.DISABLED)
             
-    def send_thread(self):
-        """Thread de envío"""
+    def journal_path(self, campaign_id):
+        return os.path.join(self.campaign_dir, f"{campaign_id}.journal")
+
+    def _remove_purged_journals(self, future):
+        """Borrar los diarios de las campañas purgadas (corre en el hilo de la base)"""
+        if future.exception() is not None:
+            self.log(f"⚠ No se pudieron purgar campañas viejas: {future.exception()}", 'warning')
+            return
+        for campaign_id in future.result():
+            try:
+                os.remove(self.journal_path(campaign_id))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.log(f"⚠ No se pudo borrar el diario {campaign_id}: {e}", 'warning')
+
+    def offer_resume(self):
+        """Ofrecer retomar la última campaña que quedó sin terminar"""
         try:
-            self.log("═" * 50, 'info')
-            self.log("🚀 INICIANDO ENVÍO", 'success')
-            self.log("═" * 50, 'info')
+            campaign = self.campaign_store.latest_unfinished()
+            if campaign is None:
+                return
+            campaign_id, created, total = campaign
+            journal_path = self.journal_path(campaign_id)
+            if os.path.exists(journal_path):
+                _, states = CampaignJournal.replay(journal_path)
+            else:
+                states = self.campaign_store.message_states(campaign_id, total)
+        except (OSError, ValueError, struct.error, sqlite3.Error) as e:
+            self.log(f"⚠ No se pudo leer la campaña pendiente: {e}", 'warning')
+            return
+
+        first = states.find(0)
+        if first == -1:
+            self.campaign_store.set_campaign_status(campaign_id, 'finished')
+            return
+
+        sent = states.count(JOURNAL_SENT)
+        failed = states.count(JOURNAL_FAILED)
+        pending = total - sent - failed
+        if not messagebox.askyesno(
+            "Campaña sin terminar",
+            f"La campaña del {created.replace('T', ' ')} quedó sin terminar.\n\n"
+            f"Enviados: {sent} | Fallidos: {failed} | Pendientes: {pending}\n\n"
+            f"¿Retomarla desde el mensaje {first + 1}?"
+        ):
+            self.campaign_store.set_campaign_status(campaign_id, 'abandoned')
+            return
+
+        links = StoredLinks(self.campaign_store, campaign_id, total)
+        self.links = links
+        self.total_messages = total
+        self.sent_count = sent
+        self.failed_count = failed
+        self.current_index = sent + failed
+        self.pending_resume = {'campaign_id': campaign_id, 'states': states, 'links': links}
+        self.update_stats()
+        self.log(f"↻ Campaña {campaign_id} lista para retomar: {pending} mensajes pendientes", 'success')
+        self.log("Detecta los dispositivos e inicia el envío para continuar", 'info')
+
+    async def run_campaign(self, resume=None):
+        """Campaña de envío en el event loop: una tarea por dispositivo sobre una cola compartida"""
+        control = self.send_control = SendControl()
+        # Pausa o cancelación pedidas antes de que existiera el control
+        if self.is_paused:
+            control.pause()
+        if self.should_stop:
+            control.stop()
+        try:
+            self.post_log("═" * 50, 'info')
+            self.post_log("🚀 INICIANDO ENVÍO", 'success')
+            self.post_log("═" * 50, 'info')
 
             pkg = "com.whatsapp.w4b"
             chrome = "com.android.chrome/com.google.android.apps.chrome.Main"
-            idx = 0
 
-            for device in self.devices:
-                if self.should_stop:
-                    break
-                self.close_all_apps(device)
+            self.unready_devices = set()
+            ready = await self.run_preflight(self.devices, pkg)
+            # El grupo de la campaña va aparte: la lista detectada no se toca
+            self.unready_devices = set(self.devices) - set(ready)
+            self.campaign_devices = ready
 
-            if self.should_stop:
-                self.log("⚠ Envío cancelado", 'warning')
+            if control.is_stopped:
+                self.post_log("⚠ Envío cancelado", 'warning')
                 return
-
-            self.log("🕒 Esperando 3s antes de iniciar el envío...", 'info')
-            while self.is_paused and not self.should_stop:
-                time.sleep(0.1)
-            if self.should_stop:
-                self.log("⚠ Envío cancelado", 'warning')
+            if not self.campaign_devices:
+                self.post_log("❌ Ningún dispositivo está listo para enviar", 'error')
+                self.call_in_ui(messagebox.showerror, "Error",
+                                "Ningún dispositivo pasó la verificación previa")
                 return
-            time.sleep(3)
-            if self.should_stop:
-                self.log("⚠ Envío cancelado", 'warning')
+
+            total = len(self.links)
+            store = self.campaign_store
+            if resume:
+                campaign_id, done = resume['campaign_id'], resume['states']
+                with self.stats_lock:
+                    self.sent_count = done.count(JOURNAL_SENT)
+                    self.failed_count = done.count(JOURNAL_FAILED)
+                    self.current_index = self.sent_count + self.failed_count
+                self.post_stats()
+                self.post_log(f"↻ Retomando campaña {campaign_id} desde el mensaje {done.find(0) + 1}", 'info')
+                prepared = None
+            else:
+                campaign_id, done = await asyncio.wrap_future(store.create_campaign(total)), None
+                # Los mensajes se guardan en la base mientras corre la espera inicial
+                self.post_log(f"💾 Guardando {total} mensajes de la campaña {campaign_id}...", 'info')
+                prepared = asyncio.wrap_future(store.add_messages(campaign_id, self.links))
+            self.campaign_id = campaign_id
+            self.journal = CampaignJournal(self.journal_path(campaign_id), total)
+
+            self.post_log("🕒 Esperando 3s antes de iniciar el envío...", 'info')
+            await control.wait_resumed()
+            if await control.sleep(3):
+                self.post_log("⚠ Envío cancelado", 'warning')
+                store.set_campaign_status(campaign_id, 'cancelled')
                 return
+            if prepared is not None:
+                await prepared
+            # El despacho lee los enlaces de la base, por páginas
+            self.campaign_links = StoredLinks(store, campaign_id, total)
+
+            for device in self.campaign_devices:
+                if self.timing_profiles.percentile(device, 'open') is not None:
+                    open_estimate = self.timing_profiles.estimate(device, 'open', self.wait_after_open.get())
+                    enter_estimate = self.timing_profiles.estimate(
+                        device, 'first_enter', self.wait_after_first_enter.get())
+                    self.post_log(
+                        f"⏱ {device}: tiempo típico {open_estimate:.1f}s / {enter_estimate:.1f}s",
+                        'info'
+                    )
 
-            for i, link in enumerate(self.links, 1):
-                while self.is_paused and not self.should_stop:
-                    time.sleep(0.1)
-                if self.should_stop:
-                    self.log("⚠ Envío cancelado", 'warning')
-                    break
-                    
-                self.current_index = i
-                device = self.devices[idx]
-                idx = (idx + 1) % len(self.devices)
+            # Una tarea por dispositivo, todas tomando de la misma cola
+            dispatch = DispatchQueue(total, done=done)
+            self.worker_tasks = {}
+            self.pool_changed = asyncio.Event()
+            timer = asyncio.create_task(control.scheduler.run())
+            watcher = asyncio.create_task(self.watch_devices(dispatch, pkg, chrome))
+            try:
+                self._ensure_workers(dispatch, pkg, chrome)
+                await self._wait_workers(dispatch)
+            finally:
+                watcher.cancel()
+                for task in self.worker_tasks.values():
+                    task.cancel()
+                await asyncio.gather(watcher, *self.worker_tasks.values(), return_exceptions=True)
+                control.scheduler.close()
+                await timer
+            
+            if control.is_stopped:
+                self.post_log("⚠ Envío cancelado", 'warning')
+                store.set_campaign_status(campaign_id, 'cancelled')
+            elif not dispatch.pending():
+                store.set_campaign_status(campaign_id, 'finished')
+                
+            self.post_log("═" * 50, 'info')
+            self.post_log("✅ ENVÍO FINALIZADO", 'success')
+            self.post_log(f"Enviados: {self.sent_count} | Fallidos: {self.failed_count}", 'info')
+            
+            self.call_in_ui(messagebox.showinfo, "Completado",
+                f"Enviados: {self.sent_count}\nFallidos: {self.failed_count}")
+        except Exception as e:
+            self.post_log(f"❌ Error en el envío: {e}", 'error')
+        finally:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            try:
+                await asyncio.wrap_future(self.campaign_store.flush())
+            except sqlite3.Error as e:
+                self.post_log(f"⚠ No se pudo guardar la campaña en la base: {e}", 'warning')
+            await self.close_adb_sessions()
+            try:
+                self.timing_profiles.save()
+            except OSError as e:
+                self.post_log(f"⚠ No se pudieron guardar los tiempos: {e}", 'warning')
+            self.call_in_ui(self._on_campaign_finished)
+
+    def _ensure_workers(self, dispatch, pkg, chrome):
+        """Lanzar una tarea para cada dispositivo conectado que no tenga una activa"""
+        if not dispatch.pending():
+            return
+        for device in self.campaign_devices:
+            task = self.worker_tasks.get(device)
+            if task is None or task.done():
+                self.worker_tasks[device] = asyncio.create_task(
+                    self._device_worker(device, dispatch, pkg, chrome))
+
+    async def _wait_workers(self, dispatch):
+        """Esperar a que se vacíe la cola, aunque el grupo de dispositivos cambie a mitad"""
+        control = self.send_control
+        warned = False
+        while not control.is_stopped:
+            active = [task for task in self.worker_tasks.values() if not task.done()]
+            if active:
+                warned = False
+                self.pool_changed.clear()
+                changed = asyncio.create_task(self.pool_changed.wait())
+                await asyncio.wait(active + [changed], return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+                continue
+            for index in dispatch.drop_unservable(self.campaign_devices):
+                self.journal.record(index, JOURNAL_FAILED)
+                self.campaign_store.set_message_status(self.campaign_id, index, 'failed')
+                with self.stats_lock:
+                    self.failed_count += 1
+                self.post_log(f"❌ Mensaje {index + 1} descartado: ningún dispositivo puede enviarlo", 'error')
+                self.post_stats()
+            if not dispatch.pending():
+                break
+            if not warned:
+                self.post_log("⚠ Sin dispositivos conectados: esperando reconexión...", 'warning')
+                warned = True
+            self.pool_changed.clear()
+            changed = asyncio.create_task(self.pool_changed.wait())
+            stopped = asyncio.create_task(control.stopped.wait())
+            await asyncio.wait([changed, stopped], return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+            stopped.cancel()
+
+    async def _list_devices(self):
+        if self.adb_native:
+            return await asyncio.get_running_loop().run_in_executor(None, self.adb_client.devices)
+        process = await asyncio.create_subprocess_exec(
+            self.adb_path.get(), 'devices',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        output, _ = await asyncio.wait_for(process.communicate(), 10)
+        return parse_device_listing(output.decode('utf-8', errors='replace'))
 
-                self.close_all_apps(device)
+    async def watch_devices(self, dispatch, pkg, chrome):
+        """Seguir altas y bajas de dispositivos durante el envío (track-devices o sondeo)"""
+        control = self.send_control
+        while not control.is_stopped:
+            try:
+                if self.adb_native:
+                    async for listing in self.adb_client.track_devices():
+                        await self._apply_device_listing(listing, dispatch, pkg, chrome)
+                else:
+                    await self._apply_device_listing(await self._list_devices(), dispatch, pkg, chrome)
+            except (OSError, AdbError, asyncio.TimeoutError):
+                pass
+            await control.sleep(DEVICE_POLL_INTERVAL)
+
+    async def _apply_device_listing(self, listing, dispatch, pkg, chrome):
+        online = [serial for serial, state in listing if state == 'device']
+        # Un equipo rechazado vuelve a verificarse si se desconecta y reconecta
+        self.unready_devices &= set(online)
+        added = [
+            device for device in online
+            if device not in self.campaign_devices and device not in self.unready_devices
+        ]
+        removed = [device for device in self.campaign_devices if device not in online]
+        if not added and not removed:
+            return
 
-                while self.is_paused and not self.should_stop:
-                    time.sleep(0.1)
-                if self.should_stop:
-                    self.log("⚠ Envío cancelado", 'warning')
-                    break
+        self.campaign_devices = [device for device in self.campaign_devices if device in online]
+
+        for device in removed:
+            self.post_log(f"🔌 Dispositivo desconectado: {device}", 'warning')
+            task = self.worker_tasks.pop(device, None)
+            if task is not None and not task.done():
+                task.cancel()
+                # La tarea reencola su mensaje en curso al cancelarse
+                await asyncio.gather(task, return_exceptions=True)
+            session = self.adb_sessions.pop(device, None)
+            if session is not None:
+                await session.close()
+
+        if added:
+            for device in added:
+                self.post_log(f"🔌 Dispositivo conectado: {device}", 'success')
+            ready = await self.run_preflight(added, pkg)
+            self.unready_devices.update(set(added) - set(ready))
+            self.campaign_devices += [device for device in ready if device not in self.campaign_devices]
+
+        self.post_log(f"📱 Dispositivos activos: {len(self.campaign_devices)}", 'info')
+        self._ensure_workers(dispatch, pkg, chrome)
+        self.pool_changed.set()
+
+    async def run_preflight(self, devices, pkg):
+        """Verificar todos los dispositivos a la vez y devolver los que están listos"""
+        self.post_log(f"🩺 Verificación previa de {len(devices)} dispositivo(s)...", 'info')
+        results = await asyncio.gather(*(
+            asyncio.wait_for(self.preflight_device(device, pkg), PREFLIGHT_TIMEOUT)
+            for device in devices
+        ), return_exceptions=True)
+
+        ready = []
+        for device, result in zip(devices, results):
+            if isinstance(result, asyncio.TimeoutError):
+                problems = [f"no respondió en {PREFLIGHT_TIMEOUT}s"]
+                # La sesión quedó a mitad de un comando
+                session = self.adb_sessions.pop(device, None)
+                if session is not None:
+                    await session.close()
+            elif isinstance(result, Exception):
+                problems = [str(result)]
+            else:
+                problems = result
 
-                if self.send_msg(device, link, i, len(self.links), pkg, chrome):
-                    self.sent_count += 1
+            if problems:
+                self.post_log(f"  ✗ {device}: {'; '.join(problems)}", 'error')
+            else:
+                self.post_log(f"  ✓ {device}", 'success')
+                ready.append(device)
+
+        self.post_log(
+            f"📋 {len(ready)}/{len(devices)} dispositivo(s) listo(s)",
+            'success' if len(ready) == len(devices) else 'warning'
+        )
+        return ready
+
+    async def preflight_device(self, device, pkg):
+        """Preparar un dispositivo: cierra apps, revisa paquetes, pantalla encendida y desbloqueada.
+
+        Devuelve la lista de problemas encontrados (vacía si está listo).
+        """
+        problems = []
+        try:
+            await self.close_all_apps(device)
+
+            for label, package in (("WhatsApp Business", pkg),
+                                   ("Google", "com.google.android.googlequicksearchbox")):
+                _, output = await self.adb_shell(device, f"pm path {package}", timeout=10)
+                if 'package:' not in output:
+                    problems.append(f"{label} no instalado")
+
+            if not await self._screen_awake(device):
+                await self.adb_shell(device, "input keyevent KEYCODE_WAKEUP", timeout=10)
+                await asyncio.sleep(1)
+                if not await self._screen_awake(device):
+                    problems.append("pantalla apagada")
+
+            if await self._screen_locked(device):
+                # Sólo quita bloqueos sin clave (deslizar)
+                await self.adb_shell(device, "wm dismiss-keyguard", timeout=10)
+                await asyncio.sleep(1)
+                if await self._screen_locked(device):
+                    problems.append("pantalla bloqueada")
+        except (subprocess.TimeoutExpired, AdbError, OSError) as e:
+            problems.append(f"sin respuesta ({FAILURE_LABELS[classify_send_error(e)]})")
+        return problems
+
+    async def _screen_awake(self, device):
+        _, output = await self.adb_shell(device, "dumpsys power | grep mWakefulness=", timeout=10)
+        if 'mWakefulness=' not in output:
+            return True  # No se puede saber: no bloquear el envío
+        return 'mWakefulness=Awake' in output
+
+    async def _screen_locked(self, device):
+        _, output = await self.adb_shell(
+            device,
+            "dumpsys window | grep -E 'mShowingLockscreen|mDreamingLockscreen|isStatusBarKeyguard'",
+            timeout=10
+        )
+        return re.search(r'(mShowingLockscreen|mDreamingLockscreen|isStatusBarKeyguard)=true', output) is not None
+
+    async def adb_shell(self, device, command, timeout=10):
+        """Ejecutar un comando en la sesión persistente del dispositivo: (código, salida)"""
+        session = self.adb_sessions.get(device)
+        if session is None:
+            if self.adb_native:
+                session = AdbSocketShellSession(self.adb_client, device)
+            else:
+                session = AdbShellSession(self.adb_path.get(), device)
+            self.adb_sessions[device] = session
+        return await session.run(command, timeout)
+
+    async def close_adb_sessions(self):
+        """Cerrar todas las sesiones de shell abiertas"""
+        sessions = list(self.adb_sessions.values())
+        self.adb_sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    async def focused_window(self, device):
+        """Ventana con foco en el dispositivo, o None si no se puede consultar"""
+        try:
+            returncode, output = await self.adb_shell(
+                device, "dumpsys window | grep mCurrentFocus", timeout=5)
+        except (subprocess.TimeoutExpired, AdbError, OSError):
+            return None
+        if returncode != 0:
+            return None
+        return parse_focused_window(output)
+
+    async def wait_until_ready(self, device, step, ready, upper_bound):
+        """Esperar a que ``ready(ventana)`` se cumpla, como mucho ``upper_bound`` segundos.
+
+        Devuelve los segundos hasta estar listo, o None si el dispositivo no
+        permite consultar el foco (se esperó el tiempo típico del paso) o se
+        canceló el envío.
+        Si la consulta funciona pero nunca se cumple, lanza SendFailure de
+        timeout: seguir con los ENTER enviaría a ciegas.
+        """
+        control = self.send_control
+        start = time.monotonic()
+        deadline = start + upper_bound
+        while not control.is_stopped:
+            window = await self.focused_window(device)
+            if window is None:
+                # Sin sonda: espera fija con el tiempo típico aprendido del
+                # paso, o el máximo si el dispositivo todavía no tiene muestras
+                fallback = self.timing_profiles.estimate(device, step, upper_bound)
+                await asyncio.sleep(max(0, start + fallback - time.monotonic()))
+                return None
+            if ready(window):
+                latency = time.monotonic() - start
+                await asyncio.sleep(max(0, min(READINESS_SETTLE, deadline - time.monotonic())))
+                return latency
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SendFailure(FAILURE_TIMEOUT,
+                                  f"{device} no estuvo listo en {upper_bound}s (foco: {window or 'ninguno'})")
+            await asyncio.sleep(min(READINESS_POLL_INTERVAL, remaining))
+        return None
+
+    async def timed_step(self, device, step, ready, configured):
+        """Esperar un paso del envío (como mucho lo configurado) y registrar su latencia"""
+        latency = await self.wait_until_ready(device, step, ready, configured)
+        if latency is not None:
+            self.timing_profiles.record(device, step, latency)
+
+    async def _device_worker(self, device, dispatch, pkg, chrome):
+        """Tarea de un dispositivo: toma enlaces de la cola y respeta su propio delay"""
+        control = self.send_control
+        links = self.campaign_links
+        total = len(links)
+        index = None
+        
+        try:
+            while not control.is_stopped:
+                await control.wait_resumed()
+                await control.scheduler.wait_eligible(device)
+                await control.wait_resumed()
+                if control.is_stopped:
+                    break
+                
+                index = dispatch.get(device)
+                if index is None:
+                    wait = dispatch.retry_wait(device)
+                    if wait is None:
+                        break
+                    # Sólo quedan reintentos todavía no vencidos
+                    await control.sleep(min(wait, DEVICE_POLL_INTERVAL))
+                    continue
+                
+                with self.stats_lock:
+                    self.current_index += 1
+                
+                await self.close_all_apps(device)
+                
+                await control.wait_resumed()
+                if control.is_stopped:
+                    break
+                
+                try:
+                    await self.send_msg(device, links[index], index + 1, total, pkg, chrome)
+                except SendFailure as failure:
+                    self._schedule_retry(dispatch, index, device, failure, pkg, chrome)
                 else:
-                    self.failed_count += 1
-                    
-                self.update_stats()
+                    self.journal.record(index, JOURNAL_SENT)
+                    self.campaign_store.record_attempt(self.campaign_id, index, device, 'sent', 'sent')
+                    phone = normalize_phone(phone_from_url(links[index]))
+                    if phone is not None:
+                        self.campaign_store.record_contact(phone)
+                    with self.stats_lock:
+                        self.sent_count += 1
+                index = None
                 
-                if i < len(self.links) and not self.should_stop:
+                self.post_stats()
+                
+                if dispatch.pending() and not control.is_stopped:
                     delay = random.uniform(self.delay_min.get(),
                                           self.delay_max.get())
-                    self.log(f"⏳ Esperando {delay:.1f}s...", 'info')
-                    
-                    elapsed = 0
-                    while elapsed < delay and not self.should_stop:
-                        while self.is_paused and not self.should_stop:
-                            time.sleep(0.1)
-                        time.sleep(0.1)
-                        elapsed += 0.1
-                        
-            self.log("═" * 50, 'info')
-            self.log("✅ ENVÍO FINALIZADO", 'success')
-            self.log(f"Enviados: {self.sent_count} | Fallidos: {self.failed_count}", 'info')
-            
-            messagebox.showinfo("Completado",
-                f"Enviados: {self.sent_count}\nFallidos: {self.failed_count}")
-        finally:
-            self.is_running = False
-            self.btn_start.config(state=tk.NORMAL)
-            self.btn_pause.config(state=tk.DISABLED)
-            self.btn_stop.config(state=tk.DISABLED)
+                    self.post_log(f"⏳ [{device}] Esperando {delay:.1f}s...", 'info')
+                    control.scheduler.schedule(device, delay)
+        except asyncio.CancelledError:
+            # Dispositivo desconectado: el mensaje en curso vuelve a la cola
+            if index is not None and not control.is_stopped:
+                dispatch.requeue(index)
+                with self.stats_lock:
+                    self.current_index -= 1
+                self.post_log(f"↩ Mensaje {index + 1} reencolado (se perdió {device})", 'warning')
+            raise
+
+    def _schedule_retry(self, dispatch, index, device, failure, pkg, chrome):
+        """Mandar un envío fallido a la cola de reintentos o darlo por perdido"""
+        label = FAILURE_LABELS[failure.kind]
+        attempt = dispatch.attempts(index)
+        delay = dispatch.retry(index, failure.kind, device)
+        self.campaign_store.record_attempt(
+            self.campaign_id, index, device, failure.kind,
+            'failed' if delay is None else 'pending', str(failure)
+        )
+        with self.stats_lock:
+            if delay is None:
+                self.failed_count += 1
+            else:
+                self.current_index -= 1
+        if delay is None:
+            self.journal.record(index, JOURNAL_FAILED)
+            self.post_log(f"❌ Mensaje {index + 1} descartado tras {attempt} intentos ({label})", 'error')
+            return
+        self.post_log(
+            f"🔁 Mensaje {index + 1}: reintento {attempt + 1}/{MAX_SEND_ATTEMPTS} en {delay:.0f}s ({label})",
+            'warning'
+        )
+        # Un dispositivo que ya terminó puede tomar el reintento
+        self._ensure_workers(dispatch, pkg, chrome)
 
-    def send_msg(self, device, link, i, total, pkg, chrome):
-        """Enviar mensaje - Abre Google e inyecta URL"""
+    async def send_msg(self, device, link, i, total, pkg, chrome):
+        """Enviar mensaje - Abre Google e inyecta URL (lanza SendFailure si falla)"""
         try:
-            num = link.split('wa.me/')[1].split('?')[0] if 'wa.me/' in link else "?"
-            self.log(f"📱 {i}/{total} → {num}", 'info')
-            
-            adb = self.adb_path.get()
+            num = phone_from_url(link)
+            self.post_log(f"📱 {i}/{total} → {num} ({device})", 'info')
             
             # Cerrar WhatsApp primero
-            subprocess.run([adb, '-s', device, 'shell', 'am', 'force-stop', pkg], 
-                          capture_output=True, timeout=10)
-            time.sleep(1)
+            await self.adb_shell(device, f"am force-stop {pkg}", timeout=10)
+            await asyncio.sleep(1)
             
             # Abrir Google app e inyectar URL
-            self.log("🔗 Abriendo Google e inyectando URL...", 'info')
+            self.post_log("🔗 Abriendo Google e inyectando URL...", 'info')
             
             # Usar monkey para abrir Google con el URL
             cmd = f'monkey -p com.google.android.googlequicksearchbox -c android.intent.category.LAUNCHER 1 && sleep 1 && am start -a android.intent.action.VIEW -d "{link}"'
-            subprocess.run([adb, '-s', device, 'shell', cmd], 
-                          capture_output=True, timeout=15, shell=False)
+            _, output = await self.adb_shell(device, cmd, timeout=15)
+            if 'No activities found' in output or 'unable to resolve Intent' in output:
+                raise SendFailure(FAILURE_APP_MISSING, output.strip().splitlines()[-1])
             
-            time.sleep(self.wait_after_open.get())
+            # Esperar a que WhatsApp tome el foco (la configuración es el máximo)
+            await self.timed_step(
+                device, 'open',
+                lambda window: window.startswith(f"{pkg}/"),
+                self.wait_after_open.get()
+            )
             
             # Primer Enter (abrir chat en WhatsApp)
-            subprocess.run([adb, '-s', device, 'shell', 'input', 'keyevent', '66'], 
-                          capture_output=True, timeout=10)
-            time.sleep(self.wait_after_first_enter.get())
+            await self.adb_shell(device, "input keyevent 66", timeout=10)
+            await self.timed_step(
+                device, 'first_enter',
+                lambda window: window.startswith(f"{pkg}/") and 'Conversation' in window,
+                self.wait_after_first_enter.get()
+            )
             
             # Segundo Enter (enviar mensaje)
-            subprocess.run([adb, '-s', device, 'shell', 'input', 'keyevent', '66'], 
-                          capture_output=True, timeout=10)
-            time.sleep(1)
+            await self.adb_shell(device, "input keyevent 66", timeout=10)
+            await asyncio.sleep(1)
             
-            self.log("✅ ENVIADO", 'success')
-            return True
-        except subprocess.TimeoutExpired:
-            self.log("❌ ERROR: Timeout", 'error')
-            return False
+            self.post_log("✅ ENVIADO", 'success')
         except Exception as e:
-            self.log(f"❌ ERROR: {e}", 'error')
-            return False
+            kind = classify_send_error(e)
+            if kind == FAILURE_TIMEOUT:
+                self.post_log("❌ ERROR: Timeout", 'error')
+            else:
+                self.post_log(f"❌ ERROR ({FAILURE_LABELS[kind]}): {e}", 'error')
+            raise SendFailure(kind, str(e)) from e
 
-    def close_all_apps(self, device):
+    async def close_all_apps(self, device):
         """Cerrar aplicaciones antes de iniciar el envío"""
         adb = self.adb_path.get()
         if not adb:
-            self.log("⚠ No se puede cerrar apps: ADB no configurado", 'warning')
+            self.post_log("⚠ No se puede cerrar apps: ADB no configurado", 'warning')
             return
 
-        self.log(f"🧹 Cerrando WhatsApp y Google en {device}...", 'info')
+        self.post_log(f"🧹 Cerrando WhatsApp y Google en {device}...", 'info')
 
         targets = [
             ("WhatsApp Business", "com.whatsapp.w4b"),
@@ -2156,34 +5337,30 @@ class Hermes:
 
         for label, package in targets:
             try:
-                result = subprocess.run(
-                    [adb, '-s', device, 'shell', 'am', 'force-stop', package],
-                    capture_output=True,
-                    text=True,
-                    timeout=10
-                )
-                if result.returncode != 0:
+                returncode, output = await self.adb_shell(device, f"am force-stop {package}", timeout=10)
+                if returncode != 0:
                     had_error = True
-                    error_msg = result.stderr.strip() or result.stdout.strip() or "Error desconocido"
-                    self.log(
+                    error_msg = output.strip() or "Error desconocido"
+                    self.post_log(
                         f"⚠ No se pudo cerrar {label} ({package}) en {device}: {error_msg}",
                         'warning'
                     )
             except subprocess.TimeoutExpired:
                 had_error = True
-                self.log(f"❌ Timeout al forzar cierre de {label} ({package}) en {device}", 'error')
+                self.post_log(f"❌ Timeout al forzar cierre de {label} ({package}) en {device}", 'error')
             except Exception as exc:
                 had_error = True
-                self.log(f"❌ Error al forzar cierre de {label} ({package}) en {device}: {exc}", 'error')
+                self.post_log(f"❌ Error al forzar cierre de {label} ({package}) en {device}: {exc}", 'error')
 
         if not had_error:
-            self.log(f"✅ Apps cerradas correctamente en {device}", 'success')
+            self.post_log(f"✅ Apps cerradas correctamente en {device}", 'success')
 
 
 def main():
     root = tk.Tk()
-    Hermes(root)
+    app = Hermes(root)
     root.mainloop()
+    app.log_sink.close()
 
 if __name__ == "__main__":
     main()